@@ -1,220 +1,456 @@
 import multiprocessing
+import threading
 import time
-import random
-from multiprocessing import Process, Pipe, Manager, Value
+from multiprocessing import Process
 from .models import Direction, LightColor, Vehicle, VehicleStatus, TrafficStats
+from .profiling import Profiler
+from .spillback import SpillbackQueue
+from .registry import VehicleRegistry
+from .signals import SignalPlan
+
+DIRECTIONS = list(Direction)
+GONE = 255 # vehicle_lanes value for ids removed by the parent
 
 class ProcessTrafficLight(Process):
-    def __init__(self, direction: Direction, pipe_conn, shared_state, stats_queue):
-        super().__init__()
+    def __init__(self, direction: Direction, pipe_conn, shared_state, stats_queue, tick_rate: float = 20.0, profile_queue=None, trace_queue=None, ctx=None):
+        super().__init__(name=f"lane-{direction.value}")
+        self.ctx = ctx or multiprocessing.get_context()
         self.direction = direction
         self.pipe_conn = pipe_conn
         self.shared_state = shared_state 
         self.stats_queue = stats_queue
-        self.running = Value('b', True)
+        self.profile_queue = profile_queue # set when profiling; receives our snapshot on exit
+        self.trace_queue = trace_queue # receives new trace points, {id: [(time, position)]} per tick
+        self.profiler = Profiler(f"lane-{direction.value}")
+        self.backlog = SpillbackQueue() # owned by the lane process; arrivals come in over the pipe
+        self.registry = VehicleRegistry() # ids are issued by the parent, indexed here
+        self.next_id = 0 # one past the newest id enqueued here
+        self.running = self.ctx.Value('b', True)
         
-        # Sim params
+        # Sim params: distances in units, speeds in units per second
+        self.tick_rate = tick_rate
+        self.max_step = 4.0 / tick_rate
         self.stop_line_pos = 0.0
-        self.speed = 8.0 
+        self.speed = 160.0 
         self.car_gap = 40.0
         self.spawn_pos = -400.0 
         self.end_pos = 400.0 
 
+    def _Popen(self, process_obj):
+        # Start with our context (fork/spawn/forkserver), not necessarily the global default
+        return self.ctx.Process._Popen(process_obj)
+
     def run(self):
+        interval = 1.0 / self.tick_rate
+        last = time.time()
+        next_tick = last + interval
+        if self.profile_queue is not None:
+            self.profiler.start()
         try:
             while self.running.value:
                 try:
-                    if self.pipe_conn.poll():
-                        msg = self.pipe_conn.recv()
-                        if msg == "STOP":
-                            break
-                        elif msg in [c.value for c in LightColor]:
-                            self._update_color(msg)
+                    with self.profiler.phase("ipc"):
+                        messages = []
+                        while self.pipe_conn.poll():
+                            messages.append(self.pipe_conn.recv())
                 except (EOFError, OSError, BrokenPipeError):
                     break
+                if "STOP" in messages:
+                    break
+                for msg in messages:
+                    self._handle(msg)
                 
-                self._update_traffic()
-                time.sleep(0.05)
+                now = time.time()
+                self._update_traffic(min(now - last, self.max_step), now)
+                last = now
+
+                time.sleep(max(0.0, next_tick - time.time()))
+                next_tick = max(next_tick + interval, time.time())
         except Exception:
             pass
+        finally:
+            if self.profile_queue is not None:
+                self.profiler.stop()
+                try:
+                    self.profile_queue.put(self.profiler.snapshot())
+                except Exception:
+                    pass
+
+    def _handle(self, msg):
+        if isinstance(msg, tuple) and msg[0] == "ADD":
+            self._enqueue(*msg[1:])
+        elif isinstance(msg, tuple) and msg[0] == "REMOVE":
+            self._remove(msg[1])
+        elif isinstance(msg, tuple) and msg[0] == "TRACE":
+            self.registry.trace(msg[1])
+        elif isinstance(msg, tuple) and msg[0] == "UNTRACE":
+            self.registry.untrace(msg[1])
+        elif isinstance(msg, tuple) and msg[0] == "FIND":
+            self.pipe_conn.send(("FOUND", msg[1], self._find(msg[1])))
+        elif msg in [c.value for c in LightColor]:
+            self._update_color(msg)
 
     def _update_color(self, color_str):
         try:
-            data = self.shared_state[self.direction.value]
-            data['color'] = color_str
-            self.shared_state[self.direction.value] = data
+            with self.profiler.phase("publish"):
+                data = self.shared_state[self.direction.value]
+                data['color'] = color_str
+                self.shared_state[self.direction.value] = data
         except Exception:
             pass
 
-    def _update_traffic(self):
-        try:
-            data = self.shared_state[self.direction.value]
-            color = data['color']
-            vehicles = list(data.get('vehicles', []))
-            
-            active = []
-            last_vehicle_pos = self.end_pos + 1000
-            
-            state_changed = False
-            has_emergency = False
-            
-            for v in vehicles:
-                limit = last_vehicle_pos - self.car_gap
-                
-                if v.position < 0 and color != LightColor.GREEN.value:
-                     limit = min(limit, 0.0 - 10)
-                
-                curr_speed = self.speed * 1.5 if v.is_emergency else self.speed
-                next_pos = v.position + curr_speed
-                if next_pos > limit:
-                    next_pos = limit
-                
-                if next_pos != v.position:
-                    v.position = next_pos
-                    state_changed = True
-                
-                if v.position > self.end_pos:
-                    self.stats_queue.put(time.time() - v.arrival_time)
-                else:
-                    active.append(v)
-                    if v.is_emergency and v.status != VehicleStatus.COMPLETED:
-                        has_emergency = True
-                
-                last_vehicle_pos = v.position
+    def _enqueue(self, vid: int, arrival: float, is_emergency: bool):
+        self.backlog.push(vid, arrival, is_emergency)
+        self.next_id = max(self.next_id, vid + 1)
+        if is_emergency:
+            # Preempt now rather than after the next tick publishes
+            self._republish()
+
+    def _find(self, vid: int):
+        loc = self.registry.locate(vid)
+        if loc is not None:
+            return self.shared_state[self.direction.value]['vehicles'][loc[1]]
+        seq = self.backlog.find(vid)
+        if seq is None:
+            return None
+        _, arrival, is_emergency = self.backlog.peek(seq)
+        return Vehicle(id=vid, direction=self.direction, arrival_time=arrival, start_waiting_time=arrival, position=self.spawn_pos, is_emergency=is_emergency)
+
+    def _remove(self, vid: int):
+        self.registry.untrace(vid)
+        loc = self.registry.locate(vid)
+        if loc is None:
+            seq = self.backlog.find(vid)
+            if seq is None or not self.backlog.cancel(seq):
+                return
+            self._republish()
+            return
+        slot = loc[1]
+        self.registry.completed(vid)
+        self._republish(slot)
 
-            if state_changed or len(active) != len(vehicles):
-                data['vehicles'] = active
-                data['has_emergency'] = has_emergency # Sync this flag for Controller
+    def _republish(self, removed_slot=None):
+        # Outside a tick: refresh the published lane (flags, backlog, index) right away,
+        # since the next tick only publishes if something moves
+        try:
+            with self.profiler.phase("publish"):
+                data = self.shared_state[self.direction.value]
+                vehicles = list(data.get('vehicles', []))
+                if removed_slot is not None:
+                    del vehicles[removed_slot]
+                    for i in range(removed_slot, len(vehicles)):
+                        self.registry.placed(vehicles[i].id, self.direction, i)
+                self._publish_lane(data, vehicles)
                 self.shared_state[self.direction.value] = data
         except Exception:
             pass
 
+    def _publish_lane(self, data, vehicles):
+        data['vehicles'] = vehicles
+        # Sync this flag for Controller
+        data['has_emergency'] = self.backlog.has_emergency() or any(
+            v.is_emergency and v.status != VehicleStatus.COMPLETED and v.position < self.end_pos for v in vehicles)
+        data['backlog'] = len(self.backlog)
+        data['index'] = {v.id: i for i, v in enumerate(vehicles)} # published slots for parent lookups
+        # Lanes are FIFO, so every id sent here below this one has left the lane
+        queued = self.backlog.first_id()
+        data['oldest'] = min([v.id for v in vehicles] + [self.next_id if queued is None else queued])
+
+    def _update_traffic(self, dt: float, now: float):
+        try:
+            with self.profiler.phase("ipc"):
+                data = self.shared_state[self.direction.value]
+            with self.profiler.phase("tick"):
+                changed, completed = self._step_vehicles(data, dt, now)
+            if completed:
+                with self.profiler.phase("ipc"):
+                    for wait in completed:
+                        self.stats_queue.put((self.direction.value, wait))
+            if self.registry.traces:
+                points = self.registry.take_points()
+                if points and self.trace_queue is not None:
+                    with self.profiler.phase("ipc"):
+                        self.trace_queue.put(points)
+            if changed:
+                with self.profiler.phase("publish"):
+                    self.shared_state[self.direction.value] = data
+        except Exception:
+            pass
+
+    def _step_vehicles(self, data, dt, now):
+        color = data['color']
+        vehicles = list(data.get('vehicles', []))
+        completed = []
+        backlog_before = len(self.backlog)
+        stop = 0.0 - 10 if color != LightColor.GREEN.value else float('inf')
+        self.backlog.admit(vehicles, self.direction, self.spawn_pos, self.car_gap, self.speed, now - dt, self.max_step, stop)
+        
+        active = []
+        last_vehicle_pos = self.end_pos + 1000
+        tracing = bool(self.registry.traces)
+
+        state_changed = False
+
+        for v in vehicles:
+            limit = last_vehicle_pos - self.car_gap
+
+            if v.position < 0 and color != LightColor.GREEN.value:
+                 limit = min(limit, 0.0 - 10)
+
+            curr_speed = self.speed * 1.5 if v.is_emergency else self.speed
+            next_pos = v.position + curr_speed * dt
+            if next_pos > limit:
+                next_pos = limit
+
+            if next_pos != v.position:
+                v.position = next_pos
+                state_changed = True
+            if tracing:
+                self.registry.record(v.id, now, v.position)
+
+            if v.position > self.end_pos:
+                completed.append(now - v.arrival_time)
+                self.registry.completed(v.id)
+                if tracing:
+                    self.registry.finish(v.id) # last points still go out this tick
+            else:
+                self.registry.placed(v.id, self.direction, len(active))
+                active.append(v)
+
+            last_vehicle_pos = v.position
+
+        changed = state_changed or len(active) != len(vehicles) or len(self.backlog) != backlog_before
+        if changed:
+            self._publish_lane(data, active)
+            data['tick_time'] = now
+        return changed, completed
+
 class ProcessController:
-    def __init__(self):
-        self.manager = Manager()
+    green_duration = 5
+    yellow_duration = 2
+
+    def __init__(self, tick_rate: float = 20.0, profile: bool = False, ctx=None):
+        self.ctx = ctx or multiprocessing.get_context()
+        self.tick_rate = tick_rate
+        self.profile = profile
+        self.profiler = Profiler("main")
+        self.manager = self.ctx.Manager()
         self.shared_state = self.manager.dict()
         self.stats_queue = self.manager.Queue()
+        self.profile_queue = self.manager.Queue() if profile else None
+        self.trace_queue = self.manager.Queue()
         
         for d in Direction:
             self.shared_state[d.value] = {
                 'color': LightColor.RED.value,
                 'vehicles': [],
-                'has_emergency': False
+                'has_emergency': False,
+                'backlog': 0,
+                'index': {},
+                'tick_time': 0.0
             }
         
         self.pipes = {}
+        self.pipe_lock = threading.Lock() # GUI (arrivals) and cycle thread (colors) share the pipes
+        self.registry = VehicleRegistry() # issues ids; the per-id index lives in each lane process
+        self.vehicle_lanes = bytearray() # id - lanes_base -> Direction index (GONE once removed)
+        self.lanes_base = 1
+        self.trim_at = 1024
+        self.query_lock = threading.Lock() # one FIND round trip at a time
         self.processes = {}
         
         for d in Direction:
-            parent_conn, child_conn = Pipe()
+            parent_conn, child_conn = self.ctx.Pipe()
             self.pipes[d] = parent_conn
-            p = ProcessTrafficLight(d, child_conn, self.shared_state, self.stats_queue)
+            p = ProcessTrafficLight(d, child_conn, self.shared_state, self.stats_queue, tick_rate, self.profile_queue, self.trace_queue, self.ctx)
             self.processes[d] = p
 
         self.running = True
-        self.green_duration = 5
-        self.yellow_duration = 2
+        self.plan = SignalPlan(self.green_duration, self.yellow_duration)
 
     def start(self):
+        if self.profile:
+            self.profiler.start()
         for p in self.processes.values():
             p.start()
         
-        import threading
-        self.cycle_thread = threading.Thread(target=self._cycle_loop)
+        self.cycle_thread = threading.Thread(target=self._cycle_loop, name="controller")
         self.cycle_thread.start()
 
     def _cycle_loop(self):
-        cycle_state = 0
+        interval = 1.0 / self.tick_rate
+        sent = {}
         while self.running:
-             # Check Emergency
             emergency_dirs = []
             try:
-                for d_val, data in self.shared_state.items():
-                    if data.get('has_emergency', False):
-                        emergency_dirs.append(Direction(d_val))
+                with self.profiler.phase("ipc"):
+                    for d_val, data in self.shared_state.items():
+                        if data.get('has_emergency', False):
+                            emergency_dirs.append(Direction(d_val))
             except:
                 pass
 
-            if emergency_dirs:
-                target_d = emergency_dirs[0]
-                compatible = [Direction.NORTH, Direction.SOUTH] if target_d in [Direction.NORTH, Direction.SOUTH] else [Direction.EAST, Direction.WEST]
-                others = [d for d in Direction if d not in compatible]
-                
-                self._send_color_batch(compatible, LightColor.GREEN)
-                self._send_color_batch(others, LightColor.RED)
-                time.sleep(0.5)
-                continue
-
-            # Normal Cycle
-            if cycle_state == 0: 
-                self._send_color_batch([Direction.NORTH, Direction.SOUTH], LightColor.GREEN)
-                self._send_color_batch([Direction.EAST, Direction.WEST], LightColor.RED)
-                self._sleep_interruptible(self.green_duration)
-                cycle_state = 1
-            elif cycle_state == 1: 
-                self._send_color_batch([Direction.NORTH, Direction.SOUTH], LightColor.YELLOW)
-                self._sleep_interruptible(self.yellow_duration)
-                cycle_state = 2
-            elif cycle_state == 2: 
-                self._send_color_batch([Direction.NORTH, Direction.SOUTH], LightColor.RED)
-                self._send_color_batch([Direction.EAST, Direction.WEST], LightColor.GREEN)
-                self._sleep_interruptible(self.green_duration)
-                cycle_state = 3
-            elif cycle_state == 3: 
-                self._send_color_batch([Direction.EAST, Direction.WEST], LightColor.YELLOW)
-                self._sleep_interruptible(self.yellow_duration)
-                cycle_state = 0
-
-    def _sleep_interruptible(self, duration):
-        elapsed = 0
-        step = 0.5
-        while elapsed < duration and self.running:
-            try:
-                for data in self.shared_state.values():
-                    if data.get('has_emergency', False):
-                        return
-            except:
-                pass
-            time.sleep(step)
-            elapsed += step
+            colors = self.plan.colors(time.time(), emergency_dirs)
+            # Only transitions go over the pipes
+            for color in LightColor:
+                changed = [d for d, c in colors.items() if c == color and sent.get(d) != c]
+                if changed:
+                    self._send_color_batch(changed, color)
+            sent = colors
+            time.sleep(interval)
 
     def _send_color_batch(self, directions, color):
-        for d in directions:
-            try:
-                self.pipes[d].send(color.value)
-            except OSError:
-                pass
+        with self.profiler.phase("controller"), self.pipe_lock:
+            for d in directions:
+                try:
+                    self.pipes[d].send(color.value)
+                except OSError:
+                    pass
 
     def stop(self):
         self.running = False
-        for d in self.pipes:
-            try:
-                self.pipes[d].send("STOP")
-            except OSError:
-                pass
+        with self.pipe_lock:
+            for d in self.pipes:
+                try:
+                    self.pipes[d].send("STOP")
+                except OSError:
+                    pass
         for p in self.processes.values():
             p.join()
+        self.profiler.stop()
+        if self.profile_queue is not None:
+            # Each lane process puts its own snapshot on the way out
+            while not self.profile_queue.empty():
+                self.profiler.merge(self.profile_queue.get())
 
     def add_vehicle(self, direction: Direction, is_emergency: bool = False):
+        # The lane process owns its spillback queue, so arrivals go over the pipe
         try:
-            current_data = self.shared_state[direction.value]
-            vehicles = list(current_data.get('vehicles', []))
-            v = Vehicle(id=str(random.randint(1000, 9999)), direction=direction, arrival_time=time.time(), is_emergency=is_emergency)
-            v.position = -400 # Spawn pos
-            vehicles.append(v)
-            current_data['vehicles'] = vehicles
-            self.shared_state[direction.value] = current_data
+            with self.pipe_lock:
+                vid = self.registry.issue()
+                self.vehicle_lanes.append(DIRECTIONS.index(direction))
+                self.pipes[direction].send(("ADD", vid, time.time(), is_emergency))
+                if len(self.vehicle_lanes) >= self.trim_at:
+                    self._trim_lanes()
+            return vid
+        except OSError:
+            return None
+
+    def _trim_lanes(self):
+        # Drop the prefix of ids that have left their lane (or were removed); amortized
+        # over trim_at arrivals so the map tracks live vehicles, not every id ever issued
+        try:
+            with self.profiler.phase("ipc"):
+                oldest = {Direction(d_val): data.get('oldest', 0) for d_val, data in self.shared_state.items()}
+        except Exception:
+            return
+        drop = 0
+        for lane in self.vehicle_lanes:
+            if lane != GONE and self.lanes_base + drop >= oldest[DIRECTIONS[lane]]:
+                break
+            drop += 1
+        del self.vehicle_lanes[:drop]
+        self.lanes_base += drop
+        self.trim_at = max(1024, 2 * len(self.vehicle_lanes))
+
+    def _lane_of(self, vid: int):
+        # (direction, published lane state) for a vehicle still in its lane, else None
+        with self.pipe_lock:
+            i = vid - self.lanes_base
+            if i < 0 or i >= len(self.vehicle_lanes) or self.vehicle_lanes[i] == GONE:
+                return None
+            direction = DIRECTIONS[self.vehicle_lanes[i]]
+        try:
+            with self.profiler.phase("ipc"):
+                data = self.shared_state[direction.value]
+        except Exception:
+            return None
+        if vid < data.get('oldest', 0):
+            return None # completed
+        return direction, data
+
+    def _send(self, direction: Direction, msg):
+        try:
+            with self.pipe_lock:
+                self.pipes[direction].send(msg)
+            return True
+        except OSError:
+            return False
+
+    def find_vehicle(self, vid: int):
+        lane = self._lane_of(vid)
+        if lane is None:
+            return None
+        direction, data = lane
+        slot = data.get('index', {}).get(vid)
+        if slot is not None:
+            return data['vehicles'][slot]
+        # Queued (or admitted since that snapshot): only the lane process can answer
+        conn = self.pipes[direction]
+        with self.query_lock:
+            if not self._send(direction, ("FIND", vid)):
+                return None
+            deadline = time.time() + 1.0
+            try:
+                with self.profiler.phase("ipc"):
+                    while conn.poll(max(0.0, deadline - time.time())):
+                        _, found_id, vehicle = conn.recv()
+                        if found_id == vid: # skip replies to queries that timed out
+                            return vehicle
+            except (EOFError, OSError):
+                pass
+        return None
+
+    def remove_vehicle(self, vid: int):
+        lane = self._lane_of(vid)
+        if lane is None or not self._send(lane[0], ("REMOVE", vid)):
+            return False
+        with self.pipe_lock:
+            i = vid - self.lanes_base
+            if 0 <= i < len(self.vehicle_lanes):
+                self.vehicle_lanes[i] = GONE
+        return True
+
+    def trace_vehicle(self, vid: int):
+        lane = self._lane_of(vid)
+        if lane is None:
+            return False
+        self.registry.trace(vid)
+        return self._send(lane[0], ("TRACE", vid))
+
+    def untrace_vehicle(self, vid: int):
+        self._drain_traces()
+        points = self.registry.untrace(vid)
+        lane = self._lane_of(vid)
+        if lane is not None:
+            self._send(lane[0], ("UNTRACE", vid))
+        return points
+
+    def _drain_traces(self):
+        # Lanes ship only new points; the full trajectory is assembled here
+        try:
+            with self.profiler.phase("ipc"):
+                while not self.trace_queue.empty():
+                    for vid, points in self.trace_queue.get().items():
+                        self.registry.extend(vid, points)
         except Exception:
             pass
 
+    def trajectory(self, vid: int):
+        self._drain_traces()
+        return self.registry.trajectory(vid)
+
     def get_state(self):
         try:
-            raw = self.shared_state
+            with self.profiler.phase("ipc"):
+                raw = self.shared_state.items()
             res = {}
-            for k, v in raw.items():
+            for k, v in raw:
                 res[k] = {
                     'color': v['color'],
-                    'vehicles': list(v.get('vehicles', []))
+                    'vehicles': list(v.get('vehicles', [])),
+                    'backlog': v.get('backlog', 0),
+                    'tick_time': v.get('tick_time', 0.0)
                 }
             return res
         except Exception:
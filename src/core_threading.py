@@ -1,30 +1,79 @@
+import copy
 import threading
 import time
-import random
 from collections import deque
 from .models import Direction, LightColor, Vehicle, VehicleStatus, TrafficStats
+from .profiling import Profiler
+from .spillback import SpillbackQueue
+from .registry import VehicleRegistry, QUEUED
+from .signals import SignalPlan
 
 class ThreadedTrafficLight(threading.Thread):
-    def __init__(self, direction: Direction, stats: TrafficStats):
-        super().__init__()
+    def __init__(self, direction: Direction, stats: TrafficStats, metrics=None, tick_rate: float = 20.0, profiler=None, registry=None):
+        super().__init__(name=f"lane-{direction.value}")
         self.direction = direction
         self.stats = stats
+        self.metrics = metrics
+        self.profiler = profiler or Profiler()
+        self.registry = registry if registry is not None else VehicleRegistry()
         self.color = LightColor.RED
         self.vehicles = [] 
+        self.backlog = SpillbackQueue() # arrivals waiting upstream of spawn_pos
         self.running = True
         self.lock = threading.Lock()
         
+        # Distances in units, speeds in units per second; independent of tick_rate (Hz)
+        self.tick_rate = tick_rate
+        self.max_step = 4.0 / tick_rate
+        self.last_tick = 0.0
         self.stop_line_pos = 0.0
-        self.speed = 8.0 
+        self.speed = 160.0 
         self.car_gap = 40.0 
         self.spawn_pos = -400.0 
         self.end_pos = 400.0 
 
-    def add_vehicle(self, vehicle: Vehicle):
+    def add_vehicle(self, vehicle: Vehicle, now: float = None):
+        # Arrivals queue upstream; step() moves them onto the road once the spawn gap is clear
         with self.lock:
-            vehicle.position = self.spawn_pos
-            vehicle.arrival_time = time.time()
-            self.vehicles.append(vehicle)
+            arrival = time.time() if now is None else now
+            self.backlog.push(vehicle.id, arrival, vehicle.is_emergency)
+
+    def _locate(self, vid: int):
+        # (slot, seq): a road slot from the registry, or QUEUED and the spillback sequence number
+        loc = self.registry.locate(vid)
+        if loc is not None:
+            return (loc[1], None) if loc[0] == self.direction else None
+        seq = self.backlog.find(vid)
+        return None if seq is None else (QUEUED, seq)
+
+    def holds(self, vid: int):
+        with self.lock:
+            return self._locate(vid) is not None
+
+    def find_vehicle(self, vid: int):
+        with self.lock:
+            loc = self._locate(vid)
+            if loc is None:
+                return None
+            slot, seq = loc
+            if slot == QUEUED:
+                _, arrival, is_emergency = self.backlog.peek(seq)
+                return Vehicle(id=vid, direction=self.direction, arrival_time=arrival, start_waiting_time=arrival, position=self.spawn_pos, is_emergency=is_emergency)
+            return copy.copy(self.vehicles[slot])
+
+    def remove_vehicle(self, vid: int):
+        with self.lock:
+            loc = self._locate(vid)
+            if loc is None:
+                return False
+            slot, seq = loc
+            if slot == QUEUED:
+                return self.backlog.cancel(seq)
+            del self.vehicles[slot]
+            for i in range(slot, len(self.vehicles)):
+                self.registry.placed(self.vehicles[i].id, self.direction, i)
+            self.registry.completed(vid)
+            return True
 
     def set_color(self, color: LightColor):
         with self.lock:
@@ -32,6 +81,8 @@ class ThreadedTrafficLight(threading.Thread):
 
     def has_emergency_waiting(self):
         with self.lock:
+            if self.backlog.has_emergency():
+                return True
             for v in self.vehicles:
                 if v.is_emergency and v.status != VehicleStatus.COMPLETED:
                     # If it's already past the stop line significantly, maybe we don't need to hold green?
@@ -41,153 +92,165 @@ class ThreadedTrafficLight(threading.Thread):
         return False
 
     def run(self):
+        interval = 1.0 / self.tick_rate
+        last = time.time()
+        next_tick = last + interval
         while self.running:
-            with self.lock:
-                active = []
-                last_vehicle_pos = self.end_pos + 1000 
+            now = time.time()
+            # Cap the step so a stalled thread doesn't teleport cars across the junction
+            self.step(min(now - last, self.max_step), now)
+            last = now
+
+            time.sleep(max(0.0, next_tick - time.time()))
+            next_tick = max(next_tick + interval, time.time())
+
+    def step(self, dt: float, now: float):
+        with self.profiler.phase("tick"), self.lock:
+            stop = 0.0 - 10 if self.color != LightColor.GREEN else float('inf')
+            self.backlog.admit(self.vehicles, self.direction, self.spawn_pos, self.car_gap, self.speed, now - dt, self.max_step, stop)
+            active = []
+            last_vehicle_pos = self.end_pos + 1000 
+            tracing = bool(self.registry.traces)
+            
+            for v in self.vehicles:
+                limit = last_vehicle_pos - self.car_gap
                 
-                for v in self.vehicles:
-                    limit = last_vehicle_pos - self.car_gap
-                    
-                    if v.position < 0 and self.color != LightColor.GREEN:
-                        # Allow emergency vehicles to creep closer or run red? No, safety first -> force Controller to Green.
-                        limit = min(limit, 0.0 - 10)
-                    
-                    # Logic: Emergency vehicles might move faster?
-                    current_speed = self.speed * 1.5 if v.is_emergency else self.speed
-                    
-                    next_pos = v.position + current_speed
-                    
-                    if next_pos > limit:
-                        next_pos = limit
-                    
-                    v.position = next_pos
-                    
-                    if v.position > self.end_pos:
-                        v.status = VehicleStatus.COMPLETED
-                        self.stats.add_vehicle(v)
-                    else:
-                        active.append(v)
-                    
-                    last_vehicle_pos = v.position
+                if v.position < 0 and self.color != LightColor.GREEN:
+                    # Allow emergency vehicles to creep closer or run red? No, safety first -> force Controller to Green.
+                    limit = min(limit, 0.0 - 10)
                 
-                self.vehicles = active
-
-            time.sleep(0.05)
+                # Logic: Emergency vehicles might move faster?
+                current_speed = self.speed * 1.5 if v.is_emergency else self.speed
+                
+                next_pos = v.position + current_speed * dt
+                
+                if next_pos > limit:
+                    next_pos = limit
+                
+                v.position = next_pos
+                if tracing:
+                    self.registry.record(v.id, now, v.position)
+                
+                if v.position > self.end_pos:
+                    v.status = VehicleStatus.COMPLETED
+                    v.end_waiting_time = now
+                    self.stats.add_vehicle(v)
+                    self.registry.completed(v.id)
+                    if self.metrics:
+                        self.metrics.record_completion(self.direction, now - v.arrival_time, now)
+                else:
+                    self.registry.placed(v.id, self.direction, len(active))
+                    active.append(v)
+                
+                last_vehicle_pos = v.position
+            
+            self.vehicles = active
+            self.last_tick = now
 
     def stop(self):
         self.running = False
 
 class ThreadedController(threading.Thread):
-    def __init__(self, stats: TrafficStats):
-        super().__init__()
+    green_duration = 5
+    yellow_duration = 2
+
+    def __init__(self, stats: TrafficStats, metrics=None, tick_rate: float = 20.0, profile: bool = False, scheduler=None):
+        super().__init__(name="controller")
         self.stats = stats
-        self.lights = {
-            Direction.NORTH: ThreadedTrafficLight(Direction.NORTH, stats),
-            Direction.SOUTH: ThreadedTrafficLight(Direction.SOUTH, stats),
-            Direction.EAST: ThreadedTrafficLight(Direction.EAST, stats),
-            Direction.WEST: ThreadedTrafficLight(Direction.WEST, stats),
-        }
+        self.metrics = metrics
+        # With a shared TickScheduler the lanes get no threads of their own and tick at its rate
+        self.scheduler = scheduler
+        if scheduler is not None:
+            tick_rate = scheduler.tick_rate
+        self.tick_rate = tick_rate
+        self.profile = profile
+        self.profiler = Profiler("main")
+        self.registry = VehicleRegistry()
+        self.lights = {d: ThreadedTrafficLight(d, stats, metrics, tick_rate, self.profiler, self.registry) for d in Direction}
         self.running = True
-        self.green_duration = 4
-        self.yellow_duration = 2
+        self.plan = SignalPlan(self.green_duration, self.yellow_duration)
         self.emergency_mode = False
 
-    def start_lights(self):
+    def start(self):
+        if self.profile:
+            self.profiler.start()
+        if self.scheduler is not None:
+            # Lanes and phase decisions both run on the scheduler's tick; no threads of our own.
+            # Registering here, not in a thread, means a stop() right after start() can't miss it.
+            self.scheduler.register(list(self.lights.values()), self)
+            return
         for light in self.lights.values():
             light.start()
+        super().start()
 
     def stop(self):
         self.running = False
+        if self.scheduler is not None:
+            self.scheduler.unregister(list(self.lights.values()), self)
         for light in self.lights.values():
             light.stop()
+        self.profiler.stop()
 
     def run(self):
-        self.start_lights()
-        cycle_state = 0 
-        
+        # Without a scheduler: re-evaluate the plan every tick, so emergencies preempt within one tick
+        interval = 1.0 / self.tick_rate
         while self.running:
-            # 1. Check Emergency Override
-            emergency_dirs = []
-            for d, l in self.lights.items():
-                if l.has_emergency_waiting():
-                    emergency_dirs.append(d)
-            
-            if emergency_dirs:
-                self.emergency_mode = True
-                # Prioritize the first one found or all compatible?
-                # Simplify: Give Green to the direction of the first emergency found.
-                target_d = emergency_dirs[0]
-                
-                # Check compatible (Opposite is safe usually in real life, but here intersections cross)
-                # Standard: N & S are compatible. E & W are compatible.
-                compatible = []
-                if target_d in [Direction.NORTH, Direction.SOUTH]:
-                    compatible = [Direction.NORTH, Direction.SOUTH]
-                else:
-                    compatible = [Direction.EAST, Direction.WEST]
-                
-                # Force Green for compatible
-                others = [d for d in self.lights if d not in compatible]
-                
-                # Switch to Yellow then Red for others first if they are Green?
-                # For responsiveness, we force Red immediately on others and Green on Target.
-                # Or do safety transition? Prompt says "not stay stopped". Responsiveness > Realism here.
-                
-                self._set_lights(compatible, LightColor.GREEN)
-                self._set_lights(others, LightColor.RED)
-                
-                time.sleep(0.5) # Fast check loop during emergency
-                continue
-            
-            self.emergency_mode = False
-
-            # Normal Cycle
-            if cycle_state == 0: # NS Green
-                self._set_lights([Direction.NORTH, Direction.SOUTH], LightColor.GREEN)
-                self._set_lights([Direction.EAST, Direction.WEST], LightColor.RED)
-                self._sleep_interruptible(self.green_duration)
-                cycle_state = 1
-            elif cycle_state == 1: # NS Yellow
-                self._set_lights([Direction.NORTH, Direction.SOUTH], LightColor.YELLOW)
-                self._sleep_interruptible(self.yellow_duration)
-                cycle_state = 2
-            elif cycle_state == 2: # EW Green
-                self._set_lights([Direction.NORTH, Direction.SOUTH], LightColor.RED)
-                self._set_lights([Direction.EAST, Direction.WEST], LightColor.GREEN)
-                self._sleep_interruptible(self.green_duration)
-                cycle_state = 3
-            elif cycle_state == 3: # EW Yellow
-                self._set_lights([Direction.EAST, Direction.WEST], LightColor.YELLOW)
-                self._sleep_interruptible(self.yellow_duration)
-                cycle_state = 0
-
-    def _sleep_interruptible(self, duration):
-        # Sleep in small chunks to react to emergency
-        elapsed = 0
-        step = 0.5
-        while elapsed < duration and self.running:
-            # Check emergency
-            for l in self.lights.values():
-                if l.has_emergency_waiting():
-                    return # Exit sleep early to handle emergency loop
-            time.sleep(step)
-            elapsed += step
-
-    def _set_lights(self, directions: list, color: LightColor):
-        for d in directions:
-            self.lights[d].set_color(color)
+            self.tick(time.time())
+            time.sleep(interval)
+
+    def tick(self, now: float):
+        with self.profiler.phase("controller"):
+            emergency_dirs = [d for d, l in self.lights.items() if l.has_emergency_waiting()]
+            self.emergency_mode = bool(emergency_dirs)
+            for d, color in self.plan.colors(now, emergency_dirs).items():
+                self.lights[d].set_color(color)
 
     def add_vehicle(self, direction: Direction, is_emergency: bool = False):
-        v = Vehicle(id=str(random.randint(1000, 9999)), direction=direction, arrival_time=time.time(), is_emergency=is_emergency)
+        v = Vehicle(id=self.registry.issue(), direction=direction, arrival_time=time.time(), is_emergency=is_emergency)
         self.lights[direction].add_vehicle(v)
+        return v.id
+
+    def _lane_of(self, vid: int):
+        loc = self.registry.locate(vid)
+        if loc is not None:
+            return self.lights[loc[0]]
+        # Not on the road: at most one spillback queue holds it
+        return next((light for light in self.lights.values() if light.holds(vid)), None)
+
+    def find_vehicle(self, vid: int):
+        lane = self._lane_of(vid)
+        return lane.find_vehicle(vid) if lane else None
+
+    def remove_vehicle(self, vid: int):
+        lane = self._lane_of(vid)
+        return lane.remove_vehicle(vid) if lane else False
+
+    def trace_vehicle(self, vid: int):
+        if self._lane_of(vid) is None:
+            return False
+        self.registry.trace(vid)
+        return True
+
+    def untrace_vehicle(self, vid: int):
+        # Traces are kept after the vehicle leaves so they can still be read; this frees one
+        return self.registry.untrace(vid)
+
+    def trajectory(self, vid: int):
+        return self.registry.trajectory(vid)
 
     def get_state(self):
+        with self.profiler.phase("publish"):
+            return self._snapshot()
+
+    def _snapshot(self):
         state = {}
         for d, light in self.lights.items():
             with light.lock:
+                # Copies, so the snapshot doesn't move under the reader after the lock is released
                 state[d.value] = {
                     'color': light.color.value,
-                    'vehicles': list(light.vehicles)
+                    'vehicles': [copy.copy(v) for v in light.vehicles],
+                    'backlog': len(light.backlog),
+                    'tick_time': light.last_tick
                 }
         return state
@@ -0,0 +1,246 @@
+import pickle
+import queue
+import random
+from dataclasses import dataclass, field
+from .models import Direction, LightColor, Vehicle, TrafficStats
+from .core_threading import ThreadedTrafficLight, ThreadedController
+from .core_processes import ProcessTrafficLight, ProcessController
+from .scheduler import TickScheduler
+from .signals import SignalPlan
+
+# Differential harness: every registered engine gets the same seeded arrivals under a
+# virtual clock and is compared, tick by tick, against the reference engine.
+# Each engine's lights follow the SignalPlan its controller class runs, built from that
+# controller's cycle durations, so the phase timelines compare the real cycle parameters.
+# Out of scope: wall-clock scheduling (controller/lane threads, processes, sleeps).
+
+ENGINES = {}
+REFERENCE_ENGINE = "thread"
+
+def register_engine(name):
+    def wrap(cls):
+        ENGINES[name] = cls
+        return cls
+    return wrap
+
+@dataclass
+class Arrival:
+    tick: int
+    direction: Direction
+    vehicle_id: int
+    is_emergency: bool = False
+
+@dataclass
+class Divergence:
+    tick: int
+    engine: str
+    check: str # positions / completions / phases / stats
+    expected: object
+    actual: object
+
+@dataclass
+class EquivalenceReport:
+    ticks: int
+    engines: list
+    divergence: Divergence = None
+    phase_timeline: list = field(default_factory=list) # reference colors per tick
+
+    @property
+    def equivalent(self):
+        return self.divergence is None
+
+def arrival_script(seed: int, ticks: int, tick_rate: float = 20.0, rate: float = 1.0, emergency_prob: float = 0.05):
+    # Poisson arrivals, `rate` vehicles per second across all directions
+    rng = random.Random(seed)
+    script = []
+    t = rng.expovariate(rate)
+    n = 0
+    while t * tick_rate < ticks:
+        n += 1
+        script.append(Arrival(int(t * tick_rate), rng.choice(list(Direction)), n, rng.random() < emergency_prob))
+        t += rng.expovariate(rate)
+    return script
+
+@register_engine("thread")
+class ThreadEngine:
+    # Reference: ThreadedTrafficLight.step driven directly, no threads started
+    controller = ThreadedController
+
+    def __init__(self, tick_rate: float):
+        self.stats = TrafficStats()
+        self.lights = {d: ThreadedTrafficLight(d, self.stats, tick_rate=tick_rate) for d in Direction}
+
+    def add_vehicle(self, arrival: Arrival, now: float):
+        v = Vehicle(id=arrival.vehicle_id, direction=arrival.direction, arrival_time=now, is_emergency=arrival.is_emergency)
+        self.lights[arrival.direction].add_vehicle(v, now)
+
+    def emergency_dirs(self):
+        return [d for d, light in self.lights.items() if light.has_emergency_waiting()]
+
+    def set_colors(self, colors: dict):
+        for d, c in colors.items():
+            self.lights[d].set_color(c)
+
+    def step(self, dt: float, now: float):
+        for light in self.lights.values():
+            light.step(dt, now)
+
+    def positions(self):
+        return {d: [(v.id, v.position) for v in light.vehicles] for d, light in self.lights.items()}
+
+    def stats_summary(self):
+        return self.stats.total_vehicles, self.stats.total_wait_time
+
+@register_engine("thread-pool")
+class ThreadPoolEngine(ThreadEngine):
+    # Same lanes, stepped in parallel batches by TickScheduler
+    def __init__(self, tick_rate: float):
+        super().__init__(tick_rate)
+        self.scheduler = TickScheduler(tick_rate, workers=2)
+        self.scheduler.register(list(self.lights.values()))
+
+    def step(self, dt: float, now: float):
+        self.scheduler.step(dt, now)
+
+    def close(self):
+        self.scheduler.close()
+
+class _ManagerDict(dict):
+    # Copy-on-access like a Manager DictProxy: values are stored pickled, every get is a fresh copy
+    def __init__(self, items):
+        super().__init__()
+        for key, value in items.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        return pickle.loads(dict.__getitem__(self, key))
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, pickle.dumps(value))
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+@register_engine("process")
+class ProcessEngine:
+    # ProcessTrafficLight's message handling and tick logic run in-process, with pipe
+    # messages fed to _handle and the shared state copied the way the Manager copies it
+    controller = ProcessController
+
+    def __init__(self, tick_rate: float):
+        self.shared_state = _ManagerDict({d.value: {'color': LightColor.RED.value, 'vehicles': [], 'has_emergency': False, 'backlog': 0, 'tick_time': 0.0} for d in Direction})
+        self.stats_queue = queue.Queue()
+        self.lights = {d: ProcessTrafficLight(d, None, self.shared_state, self.stats_queue, tick_rate) for d in Direction}
+        self.completed = 0
+        self.total_time = 0.0
+
+    def add_vehicle(self, arrival: Arrival, now: float):
+        self.lights[arrival.direction]._handle(("ADD", arrival.vehicle_id, now, arrival.is_emergency))
+
+    def emergency_dirs(self):
+        return [d for d in Direction if self.shared_state[d.value].get('has_emergency', False)]
+
+    def set_colors(self, colors: dict):
+        for d, c in colors.items():
+            self.lights[d]._handle(c.value)
+
+    def step(self, dt: float, now: float):
+        for light in self.lights.values():
+            light._update_traffic(dt, now)
+        while not self.stats_queue.empty():
+            _, wait = self.stats_queue.get()
+            self.completed += 1
+            self.total_time += wait
+
+    def positions(self):
+        return {d: [(v.id, v.position) for v in self.shared_state[d.value]['vehicles']] for d in Direction}
+
+    def stats_summary(self):
+        return self.completed, self.total_time
+
+def _completions(before: dict, after: dict):
+    # Vehicles present before the step and gone after it, in lane order
+    out = []
+    for d in Direction:
+        remaining = {vid for vid, _ in after[d]}
+        out.extend((d.value, vid) for vid, _ in before[d] if vid not in remaining)
+    return out
+
+def _positions_match(expected: dict, actual: dict, tolerance: float):
+    for d in Direction:
+        if [vid for vid, _ in expected[d]] != [vid for vid, _ in actual[d]]:
+            return False
+        for (_, p_exp), (_, p_act) in zip(expected[d], actual[d]):
+            if abs(p_exp - p_act) > tolerance:
+                return False
+    return True
+
+class DifferentialHarness:
+    def __init__(self, engines=None, tick_rate: float = 20.0, tolerance: float = 1e-6):
+        self.engine_names = list(engines or ENGINES)
+        if REFERENCE_ENGINE in self.engine_names:
+            # Reference always first so everything is compared against it
+            self.engine_names.remove(REFERENCE_ENGINE)
+            self.engine_names.insert(0, REFERENCE_ENGINE)
+        self.tick_rate = tick_rate
+        self.tolerance = tolerance
+
+    def run(self, script: list, ticks: int):
+        engines = {name: ENGINES[name](self.tick_rate) for name in self.engine_names}
+        plans = {name: SignalPlan(e.controller.green_duration, e.controller.yellow_duration) for name, e in engines.items()}
+        by_tick = {}
+        for a in script:
+            by_tick.setdefault(a.tick, []).append(a)
+
+        report = EquivalenceReport(ticks=0, engines=self.engine_names)
+        try:
+            return self._run(engines, plans, by_tick, report, ticks)
+        finally:
+            for engine in engines.values():
+                close = getattr(engine, 'close', None)
+                if close:
+                    close()
+
+    def _run(self, engines, plans, by_tick, report, ticks):
+        dt = 1.0 / self.tick_rate
+        completion_log = {name: [] for name in self.engine_names}
+        for tick in range(ticks):
+            now = (tick + 1) * dt
+            observed = {}
+            for name, engine in engines.items():
+                for a in by_tick.get(tick, []):
+                    engine.add_vehicle(a, now)
+                colors = plans[name].colors(now, engine.emergency_dirs())
+                engine.set_colors(colors)
+                before = engine.positions()
+                engine.step(dt, now)
+                after = engine.positions()
+                completion_log[name].extend(_completions(before, after))
+                observed[name] = {
+                    'phases': {d.value: c.value for d, c in colors.items()},
+                    'positions': after,
+                    'completions': list(completion_log[name]),
+                    'stats': engine.stats_summary(),
+                }
+
+            ref = observed[self.engine_names[0]]
+            report.phase_timeline.append(ref['phases'])
+            report.ticks = tick + 1
+            for name in self.engine_names[1:]:
+                divergence = self._compare(tick, name, ref, observed[name])
+                if divergence:
+                    report.divergence = divergence
+                    return report
+        return report
+
+    def _compare(self, tick, name, ref, obs):
+        if ref['phases'] != obs['phases']:
+            return Divergence(tick, name, 'phases', ref['phases'], obs['phases'])
+        if ref['completions'] != obs['completions']:
+            return Divergence(tick, name, 'completions', ref['completions'], obs['completions'])
+        if not _positions_match(ref['positions'], obs['positions'], self.tolerance):
+            return Divergence(tick, name, 'positions', ref['positions'], obs['positions'])
+        (ref_n, ref_t), (obs_n, obs_t) = ref['stats'], obs['stats']
+        if ref_n != obs_n or abs(ref_t - obs_t) > self.tolerance * max(ref_n, 1):
+            return Divergence(tick, name, 'stats', ref['stats'], obs['stats'])
+        return None
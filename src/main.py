@@ -1,17 +1,98 @@
 import sys
 import os
+import argparse
+import random
+import time
 
 # Add project root to sys.path so we can import from src
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.gui import TrafficGUI
-import tkinter as tk
 import multiprocessing
+from src.models import Direction, TrafficStats
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Traffic intersection simulation")
+    parser.add_argument("--headless", action="store_true", help="run without the Tk GUI")
+    parser.add_argument("--mode", choices=["thread", "process"], default="thread")
+    parser.add_argument("--duration", type=float, default=30.0, help="headless run time in seconds")
+    parser.add_argument("--tick-rate", type=float, default=20.0, help="simulation ticks per second")
+    parser.add_argument("--arrival-rate", type=float, default=1.0, help="headless arrivals per second")
+    parser.add_argument("--profile", metavar="PATH", help="write collapsed stacks to PATH and print a per-phase summary")
+    parser.add_argument("--intersections", type=int, default=1, help="thread mode: independent intersections to run")
+    parser.add_argument("--pool", action="store_true", help="thread mode: step all lanes on a shared tick-synchronized worker pool")
+    parser.add_argument("--workers", type=int, default=None, help="pool size (default: CPU count without the GIL, else 1)")
+    parser.add_argument("--metrics", metavar="PATH", help="write the per-minute metrics rollup to PATH as CSV")
+    return parser.parse_args(argv)
+
+def run_headless(args):
+    from src.core_threading import ThreadedController
+    from src.core_processes import ProcessController
+    from src.scheduler import TickScheduler
+    from src.metrics import MetricsStore, MetricsSampler
+
+    profile = bool(args.profile)
+    stats = TrafficStats()
+    metrics = MetricsStore()
+    scheduler = None
+    if args.mode == "thread":
+        if args.pool:
+            scheduler = TickScheduler(args.tick_rate, args.workers)
+            scheduler.start()
+        controllers = [ThreadedController(stats, metrics, args.tick_rate, profile and i == 0, scheduler) for i in range(args.intersections)]
+    else:
+        controllers = [ProcessController(args.tick_rate, profile)]
+    for c in controllers:
+        c.start()
+    controller = controllers[0]
+    # With several intersections the store aggregates all of them
+    samplers = [MetricsSampler(c, metrics) for c in controllers]
+    for sampler in samplers:
+        sampler.start()
+
+    end = time.time() + args.duration
+    try:
+        while time.time() < end:
+            target = random.choice(controllers)
+            target.add_vehicle(random.choice(list(Direction)), random.random() < 0.05)
+            time.sleep(random.expovariate(args.arrival_rate))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for c in controllers:
+            c.stop()
+        for sampler in samplers:
+            sampler.stop()
+            sampler.join()
+        if scheduler is not None:
+            print(f"Scheduler: {scheduler.ticks} ticks on {scheduler.workers} worker(s)")
+            scheduler.close()
+
+    if args.mode == "thread":
+        print(f"Vehículos Salidos: {stats.total_vehicles}")
+    else:
+        print(f"Vehículos Salidos: {samplers[0].completed}")
+
+    if args.metrics:
+        metrics.flush()
+        metrics.write_csv(args.metrics)
+        print(f"Metrics written to {args.metrics}")
+
+    if profile:
+        controller.profiler.write_collapsed(args.profile)
+        print(controller.profiler.summary())
+        print(f"Collapsed stacks written to {args.profile}")
 
 if __name__ == "__main__":
     # Required for Windows multiprocessing
     multiprocessing.freeze_support()
-    
-    root = tk.Tk()
-    app = TrafficGUI(root)
-    root.mainloop()
+
+    args = parse_args()
+    if args.headless:
+        run_headless(args)
+    else:
+        from src.gui import TrafficGUI
+        import tkinter as tk
+
+        root = tk.Tk()
+        app = TrafficGUI(root)
+        root.mainloop()
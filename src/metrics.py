@@ -0,0 +1,238 @@
+import threading
+import time
+from array import array
+from .models import Direction, LightColor
+
+PHASE_CODES = {LightColor.RED.value: 0, LightColor.YELLOW.value: 1, LightColor.GREEN.value: 2}
+
+# Log-spaced wait histogram edges (seconds). Quantiles are read back from the bin edges,
+# so rollups can merge waits without keeping every sample around.
+WAIT_EDGES = [0.25 * (1.5 ** i) for i in range(24)]
+
+FIELDS = ('queue', 'queue_max', 'throughput', 'phase', 'green_ratio', 'wait_p50', 'wait_p95')
+
+# name -> (bucket length in seconds, number of buckets kept)
+RESOLUTIONS = {
+    'second': (1, 3600),    # 1 hour
+    'minute': (60, 1440),   # 1 day
+    'hour': (3600, 720),    # 30 days
+}
+
+def series_key(direction: Direction, field: str):
+    return f"{direction.value}.{field}"
+
+def _wait_bin(wait):
+    for i, edge in enumerate(WAIT_EDGES):
+        if wait <= edge:
+            return i
+    return len(WAIT_EDGES)
+
+def _quantile(hist, q):
+    total = sum(hist)
+    if total == 0:
+        return 0.0
+    target = q * total
+    seen = 0
+    for i, count in enumerate(hist):
+        seen += count
+        if seen >= target:
+            return WAIT_EDGES[min(i, len(WAIT_EDGES) - 1)]
+    return WAIT_EDGES[-1]
+
+class RingBuffer:
+    def __init__(self, capacity: int, keys):
+        self.capacity = capacity
+        self.keys = list(keys)
+        # Everything is allocated up front; appends only overwrite slots.
+        self.times = array('d', [0.0]) * capacity
+        self.columns = {k: array('d', [0.0]) * capacity for k in self.keys}
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, timestamp: float, values: dict):
+        idx = (self.start + self.size) % self.capacity
+        if self.size == self.capacity:
+            self.start = (self.start + 1) % self.capacity
+        else:
+            self.size += 1
+        self.times[idx] = timestamp
+        for k in self.keys:
+            self.columns[k][idx] = values.get(k, 0.0)
+
+    def _slot(self, i):
+        return (self.start + i) % self.capacity
+
+    def _lower_bound(self, t):
+        # Timestamps are appended in increasing order, so the logical view is sorted.
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[self._slot(mid)] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, key: str, t0: float, t1: float):
+        col = self.columns[key]
+        first = self._lower_bound(t0)
+        last = self._lower_bound(t1)
+        return [(self.times[self._slot(i)], col[self._slot(i)]) for i in range(first, last)]
+
+    def latest(self, key: str, count: int):
+        col = self.columns[key]
+        first = max(0, self.size - count)
+        return [(self.times[self._slot(i)], col[self._slot(i)]) for i in range(first, self.size)]
+
+class _Bucket:
+    def __init__(self, length: int):
+        self.length = length
+        self.key = None
+        self.floor = None # first key still allowed after a flush
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.queue_sum = {d: 0 for d in Direction}
+        self.queue_max = {d: 0 for d in Direction}
+        self.completed = {d: 0 for d in Direction}
+        self.green = {d: 0 for d in Direction}
+        self.phase = {d: 0 for d in Direction}
+        self.hist = {d: [0] * (len(WAIT_EDGES) + 1) for d in Direction}
+
+    def empty(self):
+        return self.samples == 0 and not any(self.completed.values())
+
+    def values(self):
+        out = {}
+        n = max(self.samples, 1)
+        for d in Direction:
+            out[series_key(d, 'queue')] = self.queue_sum[d] / n
+            out[series_key(d, 'queue_max')] = self.queue_max[d]
+            out[series_key(d, 'throughput')] = self.completed[d] / self.length
+            out[series_key(d, 'phase')] = self.phase[d]
+            out[series_key(d, 'green_ratio')] = self.green[d] / n
+            out[series_key(d, 'wait_p50')] = _quantile(self.hist[d], 0.5)
+            out[series_key(d, 'wait_p95')] = _quantile(self.hist[d], 0.95)
+        return out
+
+# Fixed-memory time series: fed once per tick, rolled up per second, minute and hour.
+class MetricsStore:
+    def __init__(self, resolutions=None):
+        self.lock = threading.Lock()
+        keys = [series_key(d, f) for d in Direction for f in FIELDS]
+        self.rings = {}
+        self.buckets = {}
+        for name, (length, capacity) in (resolutions or RESOLUTIONS).items():
+            self.rings[name] = RingBuffer(capacity, keys)
+            self.buckets[name] = _Bucket(length)
+
+    def _roll(self, now):
+        for name, bucket in self.buckets.items():
+            key = int(now // bucket.length)
+            if bucket.key is None:
+                bucket.key = key if bucket.floor is None else max(key, bucket.floor)
+            elif key > bucket.key:
+                if not bucket.empty():
+                    self.rings[name].append(bucket.key * bucket.length, bucket.values())
+                bucket.key = key
+                bucket.reset()
+            # A late event (key < bucket.key) is folded into the open bucket; rings stay sorted
+
+    def record_completion(self, direction: Direction, wait: float, now: float):
+        with self.lock:
+            self._roll(now)
+            b = _wait_bin(wait)
+            for bucket in self.buckets.values():
+                bucket.completed[direction] += 1
+                bucket.hist[direction][b] += 1
+
+    def sample(self, now: float, state: dict):
+        # state is the dict returned by a controller's get_state()
+        queues = {}
+        phases = {}
+        for d in Direction:
+            info = state.get(d.value, {})
+            # Vehicles short of the stop line plus arrivals still in the spillback queue
+            queues[d] = sum(1 for v in info.get('vehicles', []) if v.position < 0) + info.get('backlog', 0)
+            phases[d] = PHASE_CODES.get(info.get('color'), 0)
+
+        with self.lock:
+            self._roll(now)
+            for bucket in self.buckets.values():
+                bucket.samples += 1
+                for d in Direction:
+                    bucket.queue_sum[d] += queues[d]
+                    if queues[d] > bucket.queue_max[d]:
+                        bucket.queue_max[d] = queues[d]
+                    bucket.phase[d] = phases[d]
+                    if phases[d] == PHASE_CODES[LightColor.GREEN.value]:
+                        bucket.green[d] += 1
+
+    def flush(self):
+        # Close the open buckets so the partial interval becomes queryable.
+        with self.lock:
+            for name, bucket in self.buckets.items():
+                if not bucket.empty():
+                    self.rings[name].append(bucket.key * bucket.length, bucket.values())
+                if bucket.key is not None:
+                    bucket.floor = bucket.key + 1
+                bucket.key = None
+                bucket.reset()
+
+    def query(self, direction: Direction, field: str, t0: float, t1: float, resolution='second'):
+        with self.lock:
+            return self.rings[resolution].query(series_key(direction, field), t0, t1)
+
+    def latest(self, direction: Direction, field: str, count: int, resolution='second'):
+        with self.lock:
+            return self.rings[resolution].latest(series_key(direction, field), count)
+
+    def write_csv(self, path: str, resolution='minute'):
+        keys = [series_key(d, f) for d in Direction for f in FIELDS]
+        with self.lock:
+            ring = self.rings[resolution]
+            rows = [[ring.times[ring._slot(i)]] + [ring.columns[k][ring._slot(i)] for k in keys] for i in range(len(ring))]
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(",".join(["time"] + keys) + "\n")
+            for row in rows:
+                f.write(",".join(f"{v:g}" for v in row) + "\n")
+
+class MetricsSampler(threading.Thread):
+    # Feeds a MetricsStore without the GUI (RenderPrep does this there): one sample per
+    # controller tick, plus the completions process lanes report over stats_queue.
+    def __init__(self, controller, metrics: MetricsStore):
+        super().__init__(name="metrics-sampler", daemon=True)
+        self.controller = controller
+        self.metrics = metrics
+        self.interval = 1.0 / controller.tick_rate
+        self.running = True
+        self.completed = 0
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        next_sample = time.time()
+        while self.running:
+            self.poll()
+            next_sample += self.interval
+            time.sleep(max(0.0, next_sample - time.time()))
+            next_sample = max(next_sample, time.time())
+        self.poll()
+
+    def poll(self):
+        try:
+            state = self.controller.get_state()
+            now = time.time()
+            stats_queue = getattr(self.controller, 'stats_queue', None)
+            while stats_queue is not None and not stats_queue.empty():
+                d_val, wait = stats_queue.get()
+                self.metrics.record_completion(Direction(d_val), wait, now)
+                self.completed += 1
+            self.metrics.sample(now, state)
+        except Exception as e:
+            print(f"Metrics sampler error: {e}")
@@ -1,6 +1,7 @@
 import enum
+import threading
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 class Direction(enum.Enum):
     NORTH = "North"
@@ -20,7 +21,7 @@ class VehicleStatus(enum.Enum):
 
 @dataclass
 class Vehicle:
-    id: str
+    id: int
     direction: Direction
     arrival_time: float
     start_waiting_time: float = 0.0
@@ -40,10 +41,13 @@ class Vehicle:
 class TrafficStats:
     total_vehicles: int = 0
     total_wait_time: float = 0.0
+    # Lanes complete vehicles from several threads at once (truly parallel without the GIL)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
     
     def add_vehicle(self, vehicle: Vehicle):
-        self.total_vehicles += 1
-        self.total_wait_time += vehicle.wait_time
+        with self.lock:
+            self.total_vehicles += 1
+            self.total_wait_time += vehicle.wait_time
 
     @property
     def average_wait_time(self):
@@ -0,0 +1,122 @@
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+
+_NO_PHASE = contextlib.nullcontext()
+
+class Profiler:
+    # Sampling profiler plus named-phase timers. One per process; lane processes send
+    # their snapshot() back to the parent, which merge()s them before writing output.
+    def __init__(self, name: str = "main", interval: float = 0.005):
+        self.name = name
+        self.interval = interval
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.stacks = collections.Counter()        # collapsed stack -> samples
+        self.phase_time = collections.Counter()    # (process, phase) -> seconds
+        self.phase_calls = collections.Counter()   # (process, phase) -> calls
+        self.phase_samples = collections.Counter() # (process, phase) -> samples
+        self.current = {}                          # thread ident -> phase stack
+        self._sampler = None
+
+    def __getstate__(self):
+        # Lane processes are pickled on spawn; ship only the config, never a live sampler.
+        return {'name': self.name, 'interval': self.interval}
+
+    def __setstate__(self, state):
+        self.__init__(state['name'], state['interval'])
+
+    def start(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self.enabled = False
+        if self._sampler and self._sampler is not threading.current_thread():
+            self._sampler.join()
+        self._sampler = None
+
+    def phase(self, name: str):
+        if not self.enabled:
+            return _NO_PHASE
+        return self._timed_phase(name)
+
+    @contextlib.contextmanager
+    def _timed_phase(self, name):
+        stack = self.current.setdefault(threading.get_ident(), [])
+        stack.append(name)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            stack.pop()
+            with self.lock:
+                self.phase_time[(self.name, name)] += elapsed
+                self.phase_calls[(self.name, name)] += 1
+
+    def _sample_loop(self):
+        me = threading.get_ident()
+        while self.enabled:
+            frames = sys._current_frames()
+            thread_names = {t.ident: t.name for t in threading.enumerate()}
+            with self.lock:
+                for ident, frame in frames.items():
+                    if ident == me:
+                        continue
+                    phases = self.current.get(ident)
+                    phase = phases[-1] if phases else None
+                    parts = []
+                    while frame is not None:
+                        code = frame.f_code
+                        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    parts.append(f"[{phase}]" if phase else "[idle]")
+                    parts.append(thread_names.get(ident, str(ident)))
+                    parts.append(self.name)
+                    parts.reverse()
+                    self.stacks[";".join(p.replace(";", ",") for p in parts)] += 1
+                    if phase:
+                        self.phase_samples[(self.name, phase)] += 1
+            del frames
+            time.sleep(self.interval)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'stacks': dict(self.stacks),
+                'phase_time': dict(self.phase_time),
+                'phase_calls': dict(self.phase_calls),
+                'phase_samples': dict(self.phase_samples),
+            }
+
+    def merge(self, snap: dict):
+        with self.lock:
+            self.stacks.update(snap.get('stacks', {}))
+            self.phase_time.update(snap.get('phase_time', {}))
+            self.phase_calls.update(snap.get('phase_calls', {}))
+            self.phase_samples.update(snap.get('phase_samples', {}))
+
+    def write_collapsed(self, path: str):
+        # "frame;frame;frame count" lines, as read by flamegraph.pl / speedscope / inferno
+        with self.lock:
+            lines = [f"{stack} {count}" for stack, count in sorted(self.stacks.items())]
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def summary(self):
+        with self.lock:
+            keys = sorted(self.phase_time, key=lambda k: -self.phase_time[k])
+            rows = [f"{'Process':<16}{'Phase':<12}{'Calls':>9}{'Total s':>10}{'Mean ms':>10}{'Samples':>9}"]
+            for key in keys:
+                calls = self.phase_calls[key]
+                total = self.phase_time[key]
+                mean_ms = total / calls * 1000 if calls else 0.0
+                rows.append(f"{key[0]:<16}{key[1]:<12}{calls:>9}{total:>10.3f}{mean_ms:>10.3f}{self.phase_samples[key]:>9}")
+        return "\n".join(rows)
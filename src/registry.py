@@ -0,0 +1,97 @@
+import itertools
+import threading
+from .models import Direction
+
+QUEUED = -1 # slot value while a vehicle is still in its lane's spillback queue
+
+class _Entry:
+    __slots__ = ('direction', 'slot')
+
+    def __init__(self, direction, slot):
+        self.direction = direction
+        self.slot = slot
+
+class VehicleRegistry:
+    # Issues monotonically increasing vehicle ids and indexes vehicles on the road by
+    # id -> (direction, slot in the lane list). Lanes keep slots current while they step,
+    # so lookups never scan a lane. Queued arrivals get no entry: their lane's
+    # SpillbackQueue finds them by id (see SpillbackQueue.find), keeping the backlog compact.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.entries = {}
+        self.traces = {} # id -> [(time, position)], only for vehicles being traced
+        self.finished = set() # traced ids that left the lane; dropped after their last points are taken
+
+    def __getstate__(self):
+        # Lane processes are pickled on spawn; each builds its own index from the messages it
+        # receives, so ship nothing (the lock and id counter don't pickle).
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def issue(self):
+        with self.lock:
+            return next(self._ids)
+
+    def placed(self, vid: int, direction: Direction, slot: int):
+        entry = self.entries.get(vid)
+        if entry is None:
+            self.entries[vid] = _Entry(direction, slot)
+        else:
+            entry.slot = slot
+
+    def completed(self, vid: int):
+        self.entries.pop(vid, None)
+
+    def locate(self, vid: int):
+        entry = self.entries.get(vid)
+        if entry is None:
+            return None
+        return entry.direction, entry.slot
+
+    def __contains__(self, vid):
+        return vid in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def trace(self, vid: int):
+        with self.lock:
+            self.traces.setdefault(vid, [])
+
+    def untrace(self, vid: int):
+        with self.lock:
+            return self.traces.pop(vid, None)
+
+    def record(self, vid: int, now: float, position: float):
+        points = self.traces.get(vid)
+        if points is None:
+            return False
+        points.append((now, position))
+        return True
+
+    def extend(self, vid: int, points: list):
+        with self.lock:
+            if vid in self.traces:
+                self.traces[vid].extend(points)
+
+    def finish(self, vid: int):
+        if vid in self.traces:
+            self.finished.add(vid)
+
+    def take_points(self):
+        # Points recorded since the last call ({id: points}), for shipping deltas elsewhere
+        with self.lock:
+            out = {vid: points for vid, points in self.traces.items() if points}
+            for vid in out:
+                self.traces[vid] = []
+            for vid in self.finished:
+                self.traces.pop(vid, None)
+            self.finished.clear()
+        return out
+
+    def trajectory(self, vid: int):
+        with self.lock:
+            return list(self.traces.get(vid, []))
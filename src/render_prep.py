@@ -0,0 +1,233 @@
+import math
+import threading
+import time
+from dataclasses import dataclass, field
+from .models import Direction
+
+# Everything the Tk callback needs for one frame is computed here, off the Tk thread.
+# Items are (kind, coords, options) and map onto canvas.create_<kind>(*coords, **options).
+
+ROAD_WIDTH = 140
+
+BODY_COLORS = {
+    Direction.NORTH.value: "#3498DB",
+    Direction.SOUTH.value: "#E74C3C",
+    Direction.EAST.value: "#2ECC71",
+    Direction.WEST.value: "#F39C12"
+}
+
+CAR_ANGLES = {Direction.NORTH: 90, Direction.SOUTH: 270, Direction.EAST: 180, Direction.WEST: 0}
+
+@dataclass
+class Frame:
+    items: list = field(default_factory=list)
+    stats_text: str = None
+
+class LatestValue:
+    # Single-slot handoff: the writer overwrites, the reader only ever sees the newest frame
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = None
+        self.version = 0
+
+    def put(self, value):
+        with self.lock:
+            self.value = value
+            self.version += 1
+
+    def get(self):
+        with self.lock:
+            return self.version, self.value
+
+def scene_items(w, h):
+    cx, cy = w // 2, h // 2
+    rw = ROAD_WIDTH
+    return [
+        ('rectangle', (0, 0, w, h), {'fill': "#5B8C5A"}),
+        ('rectangle', (cx - rw/2, 0, cx + rw/2, h), {'fill': "#343837", 'outline': "#888", 'width': 1}),
+        ('rectangle', (0, cy - rw/2, w, cy + rw/2), {'fill': "#343837", 'outline': "#888", 'width': 1}),
+        ('rectangle', (cx - rw/2, cy - rw/2, cx + rw/2, cy + rw/2), {'fill': "#343837", 'outline': ""}),
+        ('line', (cx, 0, cx, cy - rw/2), {'fill': "#F1C40F", 'width': 2, 'dash': (20,20)}),
+        ('line', (cx, cy + rw/2, cx, h), {'fill': "#F1C40F", 'width': 2, 'dash': (20,20)}),
+        ('line', (0, cy, cx - rw/2, cy), {'fill': "#F1C40F", 'width': 2, 'dash': (20,20)}),
+        ('line', (cx + rw/2, cy, w, cy), {'fill': "#F1C40F", 'width': 2, 'dash': (20,20)}),
+        ('line', (cx - rw/2, cy - rw/2, cx, cy - rw/2), {'fill': "white", 'width': 6}),
+        ('line', (cx, cy + rw/2, cx + rw/2, cy + rw/2), {'fill': "white", 'width': 6}),
+        ('line', (cx - rw/2, cy, cx - rw/2, cy + rw/2), {'fill': "white", 'width': 6}),
+        ('line', (cx + rw/2, cy - rw/2, cx + rw/2, cy), {'fill': "white", 'width': 6}),
+    ]
+
+def light_items(state, cx, cy):
+    items = []
+    l_offset = ROAD_WIDTH/2 + 20
+    l_info = [
+        (Direction.NORTH, cx - l_offset, cy - l_offset),
+        (Direction.SOUTH, cx + l_offset, cy + l_offset),
+        (Direction.EAST, cx + l_offset, cy - l_offset),
+        (Direction.WEST, cx - l_offset, cy + l_offset)
+    ]
+    colors = {"Red": "#500", "Yellow": "#550", "Green": "#050"}
+    active_colors = {"Red": "#F00", "Yellow": "#FF0", "Green": "#0F0"}
+
+    for d_enum, lx, ly in l_info:
+        info = state.get(d_enum.value, {})
+        c = info.get('color', 'Red')
+
+        curr_r = active_colors["Red"] if c == "Red" else colors["Red"]
+        curr_y = active_colors["Yellow"] if c == "Yellow" else colors["Yellow"]
+        curr_g = active_colors["Green"] if c == "Green" else colors["Green"]
+
+        items.append(('rectangle', (lx-10, ly-30, lx+10, ly+30), {'fill': "#222", 'outline': "white"}))
+        items.append(('oval', (lx-6, ly-25, lx+6, ly-13), {'fill': curr_r}))
+        items.append(('oval', (lx-6, ly-6, lx+6, ly+6), {'fill': curr_y}))
+        items.append(('oval', (lx-6, ly+13, lx+6, ly+25), {'fill': curr_g}))
+
+        backlog = info.get('backlog', 0)
+        if backlog:
+            # Arrivals still upstream in the spillback queue
+            items.append(('text', (lx, ly+40), {'text': f"+{backlog}", 'fill': "white", 'font': ("TkDefaultFont", 9, "bold")}))
+    return items
+
+def car_items(x, y, direction, color, is_emergency, blink):
+    s = 0.8
+    w, h = 40*s, 22*s
+    rad = math.radians(CAR_ANGLES[direction])
+    cos_a = math.cos(rad)
+    sin_a = math.sin(rad)
+
+    def rotate(pts):
+        out = []
+        for px, py in pts:
+            out.append(px * cos_a - py * sin_a + x)
+            out.append(px * sin_a + py * cos_a + y)
+        return out
+
+    items = [('polygon', rotate([(w/2, -h/2), (w/2, h/2), (-w/2, h/2), (-w/2, -h/2)]), {'fill': color, 'outline': "black"})]
+
+    # Windshield
+    wx, wy = w * 0.2, h * 0.7
+    sx = w * 0.1
+    items.append(('polygon', rotate([(sx + wx/2, -wy/2), (sx + wx/2, wy/2), (sx - wx/2, wy/2), (sx - wx/2, -wy/2)]), {'fill': "#87CEEB", 'outline': "#555"}))
+
+    if is_emergency:
+        # Roof siren, alternating red/blue
+        nx, ny = rotate([(-5, 0)])
+        r = 4
+        items.append(('oval', (nx-r, ny-r, nx+r, ny+r), {'fill': "red" if blink else "blue", 'outline': "white"}))
+    else:
+        # Headlights
+        for px, py in [(w/2, -h/3), (w/2, h/3)]:
+            nx, ny = rotate([(px, py)])
+            r = 3
+            items.append(('oval', (nx-r, ny-r, nx+r, ny+r), {'fill': "yellow", 'outline': "orange"}))
+    return items
+
+def lane_point(d_enum, pos, cx, cy):
+    rw = ROAD_WIDTH
+    lane_offset = rw / 4
+    if d_enum == Direction.NORTH:
+        return cx - lane_offset, (cy - rw/2) + pos
+    elif d_enum == Direction.SOUTH:
+        return cx + lane_offset, (cy + rw/2) - pos
+    elif d_enum == Direction.EAST:
+        return (cx + rw/2) - pos, cy - lane_offset
+    return (cx - rw/2) + pos, cy + lane_offset
+
+class RenderPrep(threading.Thread):
+    # Pulls controller snapshots (Manager IPC in process mode), drains stats, feeds metrics
+    # and builds display lists. The Tk thread only reads `frames` and applies them.
+    def __init__(self, controller, metrics, fps: int = 60):
+        super().__init__(name="render-prep", daemon=True)
+        self.controller = controller
+        self.metrics = metrics
+        self.interval = 1.0 / fps
+        self.frames = LatestValue()
+        self.size = (1, 1) # canvas size, written by the Tk thread
+        self.running = True
+        self.frame_counter = 0 # for blinking effects
+        self.snapshots = {} # d_val -> (prev positions, curr positions, curr tick_time)
+        self.completed = 0
+        self.total_wait = 0.0
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        profiler = self.controller.profiler
+        next_frame = time.time()
+        while self.running:
+            try:
+                state = self.controller.get_state()
+                now = time.time()
+                self._drain_stats(now)
+                self.metrics.sample(now, state)
+                with profiler.phase("render-prep"):
+                    self.frames.put(self.build_frame(state, now))
+            except Exception as e:
+                print(f"Render prep error: {e}")
+
+            next_frame += self.interval
+            time.sleep(max(0.0, next_frame - time.time()))
+            next_frame = max(next_frame, time.time())
+
+    def _drain_stats(self, now):
+        stats_queue = getattr(self.controller, 'stats_queue', None)
+        if stats_queue is None:
+            return
+        profiler = self.controller.profiler
+        while True:
+            with profiler.phase("ipc"):
+                if stats_queue.empty():
+                    break
+                d_val, val = stats_queue.get()
+            self.metrics.record_completion(Direction(d_val), val, now)
+            self.completed += 1
+            self.total_wait += val
+
+    def stats_text(self):
+        stats = getattr(self.controller, 'stats', None)
+        if stats is not None:
+            count, avg = stats.total_vehicles, stats.average_wait_time
+        else:
+            count = self.completed
+            avg = self.total_wait / count if count else 0.0
+        if count == 0:
+            return None
+        return f"Vehículos Salidos: {count}\nTiempo en Sistema: {avg:.1f}s"
+
+    def interpolated_positions(self, d_val, info, now):
+        # Render one tick behind the simulation, blending the last two snapshots
+        tick_time = info.get('tick_time', 0.0)
+        positions = {v.id: v.position for v in info.get('vehicles', [])}
+        prev, curr, curr_t = self.snapshots.get(d_val, (positions, positions, tick_time))
+        if tick_time != curr_t:
+            prev, curr, curr_t = curr, positions, tick_time
+        self.snapshots[d_val] = (prev, curr, curr_t)
+
+        alpha = min(max((now - curr_t) * self.controller.tick_rate, 0.0), 1.0)
+        out = {}
+        for vid, pos in curr.items():
+            if vid in prev:
+                out[vid] = prev[vid] + (pos - prev[vid]) * alpha
+            else:
+                out[vid] = pos
+        return out
+
+    def build_frame(self, state, now):
+        self.frame_counter += 1
+        w, h = self.size
+        cx, cy = w // 2, h // 2
+        items = scene_items(w, h)
+        items.extend(light_items(state, cx, cy))
+
+        blink = (self.frame_counter // 5) % 2 == 0 # Blink every 5 frames
+        for d_val, info in state.items():
+            d_enum = Direction(d_val)
+            positions = self.interpolated_positions(d_val, info, now)
+            body_color_std = BODY_COLORS.get(d_val, "white")
+            for v in info.get('vehicles', []):
+                px, py = lane_point(d_enum, positions.get(v.id, v.position), cx, cy)
+                body = "white" if v.is_emergency else body_color_std
+                items.extend(car_items(px, py, d_enum, body, v.is_emergency, blink))
+
+        return Frame(items, self.stats_text())
@@ -0,0 +1,110 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+def gil_enabled():
+    # sys._is_gil_enabled only exists on 3.13+; older builds always have the GIL
+    check = getattr(sys, "_is_gil_enabled", None)
+    return True if check is None else check()
+
+def default_workers():
+    # Extra workers only pay off when lanes can really run in parallel
+    return (os.cpu_count() or 1) if not gil_enabled() else 1
+
+class TickScheduler:
+    # Steps every registered lane (from any number of controllers) once per tick on a
+    # fixed-size pool. Lanes are split into one batch per worker and the tick waits for
+    # all batches, so every lane sees the same (dt, now) and none runs ahead. Registered
+    # controllers make their phase decision at the start of the same tick.
+    def __init__(self, tick_rate: float = 20.0, workers: int = None):
+        self.tick_rate = tick_rate
+        self.max_step = 4.0 / tick_rate
+        self.workers = workers or default_workers()
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="lane-worker")
+        self.lock = threading.Lock()
+        self.lanes = []
+        self.batches = []
+        self.controllers = []
+        self.ticks = 0
+        self.running = False
+        self.thread = None
+
+    def register(self, lanes, controller=None):
+        with self.lock:
+            self.lanes.extend(lanes)
+            self._rebatch()
+            if controller is not None:
+                self.controllers.append(controller)
+
+    def unregister(self, lanes, controller=None):
+        with self.lock:
+            drop = set(map(id, lanes))
+            self.lanes = [lane for lane in self.lanes if id(lane) not in drop]
+            self._rebatch()
+            if controller is not None:
+                self.controllers = [c for c in self.controllers if c is not controller]
+
+    def _rebatch(self):
+        n = min(self.workers, len(self.lanes)) or 1
+        size, extra = divmod(len(self.lanes), n)
+        self.batches = []
+        start = 0
+        for i in range(n):
+            end = start + size + (1 if i < extra else 0)
+            if end > start:
+                self.batches.append(self.lanes[start:end])
+            start = end
+
+    @staticmethod
+    def _run_batch(batch, dt, now):
+        for lane in batch:
+            lane.step(dt, now)
+
+    def step(self, dt: float, now: float):
+        with self.lock:
+            batches = self.batches
+            controllers = self.controllers
+        for controller in controllers:
+            controller.tick(now)
+        if len(batches) == 1:
+            self._run_batch(batches[0], dt, now)
+        else:
+            futures = [self.pool.submit(self._run_batch, batch, dt, now) for batch in batches]
+            wait(futures) # per-tick barrier
+            for f in futures:
+                f.result() # surface lane errors instead of losing them
+        self.ticks += 1
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="tick-scheduler", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        interval = 1.0 / self.tick_rate
+        last = time.time()
+        next_tick = last + interval
+        while self.running:
+            now = time.time()
+            try:
+                self.step(min(now - last, self.max_step), now)
+            except Exception as e:
+                print(f"Scheduler Error: {e}")
+            last = now
+
+            time.sleep(max(0.0, next_tick - time.time()))
+            next_tick = max(next_tick + interval, time.time())
+
+    def stop(self):
+        self.running = False
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def close(self):
+        self.stop()
+        self.pool.shutdown(wait=True)
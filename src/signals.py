@@ -0,0 +1,34 @@
+from .models import Direction, LightColor
+
+NS = [Direction.NORTH, Direction.SOUTH]
+EW = [Direction.EAST, Direction.WEST]
+
+class SignalPlan:
+    # The controllers' cycle, driven by whatever clock the caller passes in: NS green,
+    # NS yellow, EW green, EW yellow. An emergency gives green to its axis immediately;
+    # afterwards the normal cycle resumes its current state with a fresh timer.
+    def __init__(self, green_duration: float, yellow_duration: float):
+        self.green_duration = green_duration
+        self.yellow_duration = yellow_duration
+        self.cycle_state = 0
+        self.phase_start = None
+
+    def colors(self, now: float, emergency_dirs: list):
+        if emergency_dirs:
+            # Standard: N & S are compatible. E & W are compatible.
+            compatible = NS if emergency_dirs[0] in NS else EW
+            self.phase_start = None
+            return {d: LightColor.GREEN if d in compatible else LightColor.RED for d in Direction}
+
+        if self.phase_start is None:
+            self.phase_start = now
+        duration = self.green_duration if self.cycle_state in (0, 2) else self.yellow_duration
+        if now - self.phase_start >= duration:
+            self.cycle_state = (self.cycle_state + 1) % 4
+            self.phase_start = now
+
+        green_axis, red_axis = (NS, EW) if self.cycle_state in (0, 1) else (EW, NS)
+        lit = LightColor.GREEN if self.cycle_state in (0, 2) else LightColor.YELLOW
+        out = {d: lit for d in green_axis}
+        out.update({d: LightColor.RED for d in red_axis})
+        return out
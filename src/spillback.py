@@ -0,0 +1,117 @@
+import bisect
+from array import array
+from .models import Direction, Vehicle
+
+EMERGENCY = 1
+CANCELLED = 2
+
+class SpillbackQueue:
+    # Upstream arrivals that don't fit behind the spawn point yet. Kept as parallel arrays
+    # (id, arrival time, flags) instead of Vehicle objects, and never iterated by the tick.
+    def __init__(self):
+        self.ids = array('q')
+        self.arrivals = array('d')
+        self.flags = array('b')
+        self.head = 0
+        self.base = 0 # absolute sequence number of slot 0, so seq numbers survive compaction
+        self.count = 0
+        self.emergencies = 0
+        self.ordered = True # ids pushed in ascending order, so find() can bisect
+
+    def __len__(self):
+        return self.count
+
+    def has_emergency(self):
+        return self.emergencies > 0
+
+    def push(self, vid: int, arrival: float, is_emergency: bool = False):
+        if self.head < len(self.ids) and vid <= self.ids[-1]:
+            self.ordered = False
+        self.ids.append(vid)
+        self.arrivals.append(arrival)
+        self.flags.append(EMERGENCY if is_emergency else 0)
+        self.count += 1
+        if is_emergency:
+            self.emergencies += 1
+        return self.base + len(self.ids) - 1
+
+    def cancel(self, seq: int):
+        i = seq - self.base
+        if i < self.head or i >= len(self.ids) or self.flags[i] & CANCELLED:
+            return False
+        if self.flags[i] & EMERGENCY:
+            self.emergencies -= 1
+        self.flags[i] |= CANCELLED
+        self.count -= 1
+        return True
+
+    def find(self, vid: int):
+        # Sequence number of a live queued id. Ids are issued monotonically, so this is a
+        # bisect over the live part instead of a per-vehicle index.
+        if self.ordered:
+            i = bisect.bisect_left(self.ids, vid, self.head)
+        else:
+            i = next((j for j in range(self.head, len(self.ids)) if self.ids[j] == vid), len(self.ids))
+        if i < len(self.ids) and self.ids[i] == vid and not self.flags[i] & CANCELLED:
+            return self.base + i
+        return None
+
+    def first_id(self):
+        # Oldest live id, or None; skips (and drops) cancelled entries at the head
+        while self.head < len(self.ids) and self.flags[self.head] & CANCELLED:
+            self.head += 1
+        return self.ids[self.head] if self.head < len(self.ids) else None
+
+    def peek(self, seq: int):
+        i = seq - self.base
+        if i < self.head or i >= len(self.ids) or self.flags[i] & CANCELLED:
+            return None
+        return self.ids[i], self.arrivals[i], bool(self.flags[i] & EMERGENCY)
+
+    def pop(self):
+        while self.head < len(self.ids):
+            i = self.head
+            self.head += 1
+            flags = self.flags[i]
+            if flags & CANCELLED:
+                continue
+            self.count -= 1
+            if flags & EMERGENCY:
+                self.emergencies -= 1
+            out = (self.ids[i], self.arrivals[i], bool(flags & EMERGENCY))
+            self._compact()
+            return out
+        self._compact()
+        return None
+
+    def _compact(self):
+        # Drop the consumed prefix once it dominates, so storage tracks the live backlog
+        if self.head >= 1024 and self.head * 2 >= len(self.ids):
+            del self.ids[:self.head]
+            del self.arrivals[:self.head]
+            del self.flags[:self.head]
+            self.base += self.head
+            self.head = 0
+        if self.head == len(self.ids):
+            self.ordered = True # nothing live left out of order
+
+    def admit(self, vehicles: list, direction: Direction, spawn_pos: float, car_gap: float, speed: float, since: float, max_step: float, limit: float = float('inf')):
+        # Move arrivals into the lane while there is room behind the tail. An arrival that
+        # was waiting follows the tail at car_gap (it started moving when the gap opened, not
+        # at this tick), but never further than it could have driven since it arrived, capped
+        # at one max_step like any lane step, and never past `limit` (the red-light stop).
+        # `since` is the time the lane was last stepped to. Returns the number admitted.
+        admitted = 0
+        while self.count:
+            room = vehicles[-1].position - car_gap if vehicles else float('inf')
+            if room < spawn_pos:
+                break
+            item = self.pop()
+            if item is None:
+                break
+            vid, arrival, is_emergency = item
+            drive = min(since - arrival, max_step)
+            position = max(spawn_pos, min(room, limit, spawn_pos + speed * drive))
+            vehicles.append(Vehicle(id=vid, direction=direction, arrival_time=arrival, start_waiting_time=arrival, position=position, is_emergency=is_emergency))
+            admitted += 1
+        return admitted
@@ -1,5 +1,6 @@
 import os
 import sys
+import threading
 import time
 import unittest
 
@@ -10,6 +11,10 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from src.models import Direction, TrafficStats, LightColor
 from src.core_threading import ThreadedController
 from src.core_processes import ProcessController
+from src.metrics import MetricsStore
+from src.models import Vehicle
+from src.profiling import Profiler
+from src.equivalence import ENGINES, DifferentialHarness, ThreadEngine, arrival_script, register_engine
 
 class TestTrafficSimulation(unittest.TestCase):
     def test_threaded_controller(self):
@@ -57,5 +62,448 @@ class TestTrafficSimulation(unittest.TestCase):
         controller.stop()
         print("Process Controller OK.")
 
+    def test_process_controller_spawn(self):
+        # spawn is the default start method on Windows and macOS: lanes must pickle
+        import multiprocessing
+        controller = ProcessController(ctx=multiprocessing.get_context("spawn"))
+        controller.start()
+        try:
+            vid = controller.add_vehicle(Direction.NORTH, is_emergency=True)
+            time.sleep(2)
+            self.assertTrue(all(p.is_alive() for p in controller.processes.values()))
+            self.assertEqual(controller.find_vehicle(vid).id, vid)
+        finally:
+            controller.stop()
+
+    def test_speed_independent_of_tick_rate(self):
+        from src.core_threading import ThreadedTrafficLight
+        final = []
+        for rate in (5.0, 20.0):
+            light = ThreadedTrafficLight(Direction.NORTH, TrafficStats(), tick_rate=rate)
+            light.set_color(LightColor.GREEN)
+            light.add_vehicle(Vehicle(id=1, direction=Direction.NORTH, arrival_time=0.0))
+            for i in range(int(rate)): # one simulated second
+                light.step(1.0 / rate, (i + 1) / rate)
+            final.append(light.vehicles[0].position)
+        self.assertAlmostEqual(final[0], final[1])
+        self.assertAlmostEqual(final[0], -400.0 + 160.0)
+
+    def test_overload_throughput_independent_of_tick_rate(self):
+        from src.core_threading import ThreadedTrafficLight
+        done = []
+        for rate in (5.0, 10.0, 20.0):
+            stats = TrafficStats()
+            light = ThreadedTrafficLight(Direction.NORTH, stats, tick_rate=rate)
+            light.set_color(LightColor.GREEN)
+            for i in range(1000):
+                light.add_vehicle(Vehicle(id=i + 1, direction=Direction.NORTH, arrival_time=0.0), now=0.0)
+            for i in range(int(60 * rate)): # one simulated minute
+                light.step(1.0 / rate, (i + 1) / rate)
+            done.append(stats.total_vehicles)
+            positions = [v.position for v in light.vehicles]
+            self.assertTrue(all(a - b >= light.car_gap - 1e-9 for a, b in zip(positions, positions[1:])))
+        self.assertLessEqual(max(done) - min(done), 1)
+        # Saturation flow is speed / car_gap once the first car has crossed
+        self.assertAlmostEqual(done[0], (60 - 800 / 160) * 160 / 40, delta=2)
+
+class TestSpillback(unittest.TestCase):
+    def test_overload_stays_upstream(self):
+        from src.core_threading import ThreadedTrafficLight
+        light = ThreadedTrafficLight(Direction.NORTH, TrafficStats()) # stays red
+        for i in range(5000):
+            light.add_vehicle(Vehicle(id=i, direction=Direction.NORTH, arrival_time=0.0), now=0.0)
+        for tick in range(200):
+            light.step(0.05, tick * 0.05)
+
+        # Only what fits between spawn and the stop line is materialized
+        self.assertLessEqual(len(light.vehicles), int((0.0 - light.spawn_pos) / light.car_gap))
+        self.assertEqual(len(light.vehicles) + len(light.backlog), 5000)
+        positions = [v.position for v in light.vehicles]
+        self.assertEqual(len(positions), len(set(positions)))
+        self.assertFalse(light.has_emergency_waiting())
+
+        light.add_vehicle(Vehicle(id=9999, direction=Direction.NORTH, arrival_time=0.0, is_emergency=True), now=10.0)
+        self.assertTrue(light.has_emergency_waiting())
+
+    def test_queue_compacts_and_cancels(self):
+        from src.spillback import SpillbackQueue
+        q = SpillbackQueue()
+        seqs = [q.push(i, float(i), i == 2500) for i in range(3000)]
+        self.assertTrue(q.cancel(seqs[1]))
+        self.assertFalse(q.cancel(seqs[1]))
+        popped = [q.pop()[0] for _ in range(2000)]
+        self.assertNotIn(1, popped)
+        self.assertLess(len(q.ids), 3000) # consumed prefix was dropped
+        self.assertEqual(len(q), 999)
+        self.assertTrue(q.has_emergency())
+        self.assertTrue(q.cancel(seqs[2500]))
+        self.assertFalse(q.has_emergency())
+
+    def test_queued_vehicles_cost_no_registry_entry(self):
+        controller = ThreadedController(TrafficStats()) # lights stay red
+        ids = [controller.add_vehicle(Direction.SOUTH) for _ in range(3000)]
+        lane = controller.lights[Direction.SOUTH]
+        for tick in range(100):
+            lane.step(0.05, tick * 0.05)
+        self.assertEqual(len(controller.registry), len(lane.vehicles))
+        self.assertEqual(controller.find_vehicle(ids[2000]).id, ids[2000])
+        self.assertTrue(controller.remove_vehicle(ids[2000]))
+        self.assertIsNone(controller.find_vehicle(ids[2000]))
+        self.assertEqual(controller.find_vehicle(ids[2001]).id, ids[2001])
+
+    def test_red_light_holds_arrivals_after_stall(self):
+        import queue
+        from src.core_threading import ThreadedTrafficLight
+        from src.core_processes import ProcessTrafficLight
+        stats = TrafficStats()
+        light = ThreadedTrafficLight(Direction.NORTH, stats) # stays red
+        light.add_vehicle(Vehicle(id=1, direction=Direction.NORTH, arrival_time=0.0), now=0.0)
+        light.step(light.max_step, 3.0) # first tick after a long stall
+        self.assertLessEqual(light.vehicles[0].position, -10.0)
+        self.assertLessEqual(light.vehicles[0].position, light.spawn_pos + 2 * light.speed * light.max_step)
+        light.step(light.max_step, 6.0)
+        self.assertEqual(stats.total_vehicles, 0)
+        self.assertLessEqual(light.vehicles[0].position, -10.0)
+
+        state = {d.value: {'color': LightColor.RED.value, 'vehicles': []} for d in Direction}
+        lane = ProcessTrafficLight(Direction.NORTH, None, state, queue.Queue())
+        lane._handle(("ADD", 1, 0.0, False))
+        lane._update_traffic(lane.max_step, 3.0)
+        lane._update_traffic(lane.max_step, 6.0)
+        self.assertLessEqual(state[Direction.NORTH.value]['vehicles'][0].position, -10.0)
+
+class TestVehicleRegistry(unittest.TestCase):
+    def test_threaded_lookup_trace_and_remove(self):
+        controller = ThreadedController(TrafficStats())
+        controller.lights[Direction.NORTH].set_color(LightColor.GREEN)
+        controller.lights[Direction.EAST].set_color(LightColor.GREEN)
+        ids = [controller.add_vehicle(Direction.NORTH) for _ in range(3)]
+        amb = controller.add_vehicle(Direction.EAST, is_emergency=True)
+        self.assertEqual(ids + [amb], sorted(ids + [amb]))
+        self.assertEqual(len(set(ids + [amb])), 4)
+
+        controller.trace_vehicle(amb)
+        self.assertIsNone(controller.registry.locate(ids[2])) # queued: indexed by the spillback queue only
+        queued = controller.find_vehicle(ids[2])
+        self.assertEqual((queued.direction, queued.position), (Direction.NORTH, -400.0))
+
+        def tick(n, start):
+            for i in range(n):
+                for light in controller.lights.values():
+                    light.step(0.05, start + i * 0.05)
+
+        tick(20, 0.0)
+        lane = controller.lights[Direction.NORTH]
+        for vid in ids:
+            d, slot = controller.registry.locate(vid)
+            self.assertEqual((d, lane.vehicles[slot].id), (Direction.NORTH, vid))
+
+        self.assertTrue(controller.remove_vehicle(ids[0]))
+        self.assertIsNone(controller.find_vehicle(ids[0]))
+        self.assertEqual(controller.find_vehicle(ids[1]).id, ids[1])
+        self.assertEqual(lane.vehicles[controller.registry.locate(ids[1])[1]].id, ids[1])
+        self.assertFalse(controller.remove_vehicle(ids[0]))
+
+        tick(200, 1.0) # everything crosses
+        self.assertNotIn(amb, controller.registry)
+        self.assertEqual(len(controller.registry), 0)
+        self.assertFalse(controller.remove_vehicle(amb))
+        self.assertFalse(controller.trace_vehicle(amb))
+        path = controller.trajectory(amb)
+        self.assertGreater(len(path), 10)
+        self.assertGreater(path[-1][1], lane.end_pos)
+        self.assertEqual([p for _, p in path], sorted(p for _, p in path))
+        self.assertEqual(controller.untrace_vehicle(amb), path)
+        self.assertEqual(controller.trajectory(amb), [])
+
+    def test_process_lookup_and_trace(self):
+        controller = ProcessController()
+        controller.start()
+        try:
+            done = controller.add_vehicle(Direction.NORTH, is_emergency=True) # preempts first, crosses
+            vid = controller.add_vehicle(Direction.WEST, is_emergency=True) # held at red, then removed
+            east = [controller.add_vehicle(Direction.EAST) for _ in range(14)] # more than fit at red
+            self.assertTrue(controller.trace_vehicle(vid))
+            self.assertTrue(controller.trace_vehicle(done))
+            time.sleep(1.5)
+            found = controller.find_vehicle(vid)
+            self.assertIsNotNone(found)
+            self.assertEqual(found.id, vid)
+            queued = controller.find_vehicle(east[-1])
+            self.assertEqual((queued.id, queued.position), (east[-1], -400.0))
+            self.assertGreater(len(controller.trajectory(vid)), 5)
+            self.assertTrue(controller.remove_vehicle(vid))
+            self.assertFalse(controller.remove_vehicle(vid))
+            time.sleep(0.3)
+            self.assertIsNone(controller.find_vehicle(vid))
+            self.assertFalse(controller.shared_state[Direction.WEST.value]['has_emergency'])
+
+            time.sleep(2.5)
+            self.assertIsNone(controller.find_vehicle(done))
+            self.assertFalse(controller.remove_vehicle(done))
+            self.assertFalse(controller.trace_vehicle(done))
+            path = controller.untrace_vehicle(done)
+            self.assertGreater(path[-1][1], 400.0)
+            self.assertEqual(controller.trajectory(done), [])
+
+            with controller.pipe_lock:
+                controller._trim_lanes()
+            self.assertEqual(controller.lanes_base, east[0]) # both ambulances are gone
+            self.assertEqual(controller.find_vehicle(east[0]).id, east[0])
+        finally:
+            controller.stop()
+
+    def test_process_lane_clears_preemption_when_ambulance_removed(self):
+        import queue
+        from src.core_processes import ProcessTrafficLight
+        state = {d.value: {'color': LightColor.RED.value, 'vehicles': [], 'has_emergency': False, 'backlog': 0} for d in Direction}
+        lane = ProcessTrafficLight(Direction.NORTH, None, state, queue.Queue())
+        north = state[Direction.NORTH.value]
+
+        def tick(n):
+            for i in range(n):
+                lane._update_traffic(0.05, i * 0.05)
+
+        # Queued ambulance in an empty lane
+        lane._handle(("ADD", 1, 0.0, True))
+        self.assertTrue(north['has_emergency'])
+        lane._handle(("REMOVE", 1))
+        tick(5)
+        self.assertEqual((north['has_emergency'], north['backlog']), (False, 0))
+
+        # The only vehicle on the road, stopped at the red light
+        lane._handle(("ADD", 2, 0.0, True))
+        tick(60)
+        self.assertEqual([v.id for v in north['vehicles']], [2])
+        lane._handle(("REMOVE", 2))
+        tick(5)
+        self.assertEqual((north['has_emergency'], north['vehicles']), (False, []))
+
+class TestTickScheduler(unittest.TestCase):
+    def test_steps_every_lane_in_lockstep_on_fixed_pool(self):
+        from src.core_threading import ThreadedTrafficLight
+        from src.scheduler import TickScheduler
+        stats = TrafficStats()
+        lanes = [ThreadedTrafficLight(d, stats) for _ in range(10) for d in Direction]
+        for lane in lanes:
+            lane.set_color(LightColor.GREEN)
+            lane.add_vehicle(Vehicle(id=1, direction=lane.direction, arrival_time=0.0), now=0.0)
+
+        scheduler = TickScheduler(tick_rate=20.0, workers=3)
+        scheduler.register(lanes)
+        self.assertEqual(len(scheduler.batches), 3)
+        threads_before = threading.active_count()
+        try:
+            for tick in range(120):
+                scheduler.step(0.05, (tick + 1) * 0.05)
+                self.assertTrue(all(lane.last_tick == (tick + 1) * 0.05 for lane in lanes))
+            self.assertLessEqual(threading.active_count(), threads_before + 3)
+        finally:
+            scheduler.close()
+        self.assertEqual(scheduler.ticks, 120)
+        self.assertEqual(stats.total_vehicles, len(lanes))
+
+    def test_controllers_share_one_scheduler(self):
+        from src.scheduler import TickScheduler
+        scheduler = TickScheduler(tick_rate=20.0, workers=2)
+        scheduler.start()
+        stats = TrafficStats()
+        controllers = [ThreadedController(stats, scheduler=scheduler) for _ in range(3)]
+        try:
+            for c in controllers:
+                c.start()
+                c.add_vehicle(Direction.NORTH)
+            time.sleep(0.5)
+            self.assertEqual(len(scheduler.lanes), 12)
+            self.assertGreater(scheduler.ticks, 5)
+            self.assertFalse(any(light.is_alive() for c in controllers for light in c.lights.values()))
+            self.assertFalse(any(c.is_alive() for c in controllers))
+            self.assertEqual(len(scheduler.controllers), 3)
+            self.assertTrue(all(c.get_state()[Direction.NORTH.value]['vehicles'] for c in controllers))
+        finally:
+            for c in controllers:
+                c.stop()
+            scheduler.close()
+        self.assertEqual(scheduler.lanes, [])
+        self.assertEqual(scheduler.controllers, [])
+
+    def test_phase_changes_on_scheduler_ticks(self):
+        from src.scheduler import TickScheduler
+        scheduler = TickScheduler(tick_rate=20.0, workers=1)
+        controller = ThreadedController(TrafficStats(), scheduler=scheduler)
+        controller.start()
+        try:
+            north = []
+            for tick in range(200):
+                scheduler.step(0.05, (tick + 1) * 0.05)
+                north.append(controller.lights[Direction.NORTH].color)
+            # Green from the first tick, yellow exactly green_duration of ticks later
+            self.assertEqual(north.index(LightColor.YELLOW), int(controller.green_duration * 20))
+            self.assertEqual(north.index(LightColor.RED), int((controller.green_duration + controller.yellow_duration) * 20))
+        finally:
+            controller.stop()
+            scheduler.close()
+
+    def test_stop_right_after_start_unregisters(self):
+        from src.scheduler import TickScheduler
+        scheduler = TickScheduler(tick_rate=20.0, workers=1)
+        scheduler.start()
+        controller = ThreadedController(TrafficStats(), scheduler=scheduler)
+        controller.start()
+        controller.stop()
+        self.assertEqual((scheduler.lanes, scheduler.controllers), ([], []))
+        scheduler.close()
+
+class TestRenderPrep(unittest.TestCase):
+    def test_worker_publishes_latest_frame(self):
+        from src.render_prep import RenderPrep
+        stats = TrafficStats()
+        metrics = MetricsStore()
+        controller = ThreadedController(stats, metrics)
+        controller.start()
+        controller.add_vehicle(Direction.NORTH)
+        controller.add_vehicle(Direction.EAST, is_emergency=True)
+
+        prep = RenderPrep(controller, metrics, fps=50)
+        prep.size = (800, 600)
+        prep.start()
+        time.sleep(0.5)
+        prep.stop()
+        prep.join()
+        controller.stop()
+
+        version, frame = prep.frames.get()
+        self.assertGreater(version, 1)
+        kinds = {kind for kind, _, _ in frame.items}
+        self.assertTrue({'rectangle', 'line', 'oval', 'polygon'} <= kinds)
+        # Two cars: body + windshield each
+        self.assertGreaterEqual(sum(1 for kind, _, _ in frame.items if kind == 'polygon'), 4)
+        for kind, coords, options in frame.items:
+            self.assertTrue(all(isinstance(c, (int, float)) for c in coords))
+
+class TestMetricsStore(unittest.TestCase):
+    def _state(self, north_queue, color="Green"):
+        vehicles = [Vehicle(id=i, direction=Direction.NORTH, arrival_time=0.0, position=-50.0) for i in range(north_queue)]
+        return {Direction.NORTH.value: {'color': color, 'vehicles': vehicles}}
+
+    def test_rollups_and_range_query(self):
+        store = MetricsStore()
+        t0 = 7200.0 # aligned to an hour boundary
+        for sec in range(120):
+            for tick in range(4):
+                store.sample(t0 + sec + tick * 0.25, self._state(sec % 3))
+            store.record_completion(Direction.NORTH, 2.0, t0 + sec + 0.5)
+        store.flush()
+
+        per_sec = store.query(Direction.NORTH, 'queue', t0, t0 + 10)
+        self.assertEqual([t for t, _ in per_sec], [t0 + i for i in range(10)])
+        self.assertEqual([v for _, v in per_sec[:3]], [0.0, 1.0, 2.0])
+
+        throughput = store.query(Direction.NORTH, 'throughput', t0, t0 + 120, resolution='minute')
+        self.assertEqual(len(throughput), 2)
+        self.assertAlmostEqual(throughput[0][1], 1.0) # one vehicle per second
+        minute = store.latest(Direction.NORTH, 'queue_max', 1, resolution='minute')
+        self.assertEqual(minute[0][1], 2.0)
+        p50 = store.latest(Direction.NORTH, 'wait_p50', 1, resolution='hour')
+        self.assertTrue(2.0 <= p50[0][1] < 3.0)
+        green = store.latest(Direction.NORTH, 'green_ratio', 1, resolution='hour')
+        self.assertEqual(green[0][1], 1.0)
+
+    def test_memory_is_bounded(self):
+        store = MetricsStore({'second': (1, 10)})
+        for sec in range(50):
+            store.sample(float(sec), self._state(1))
+        ring = store.rings['second']
+        self.assertEqual(len(ring), 10)
+        self.assertEqual(len(ring.times), 10)
+        self.assertEqual(store.latest(Direction.NORTH, 'queue', 100)[0][0], 39.0)
+
+    def test_late_completion_does_not_roll_back(self):
+        store = MetricsStore()
+        store.sample(1000.5, self._state(1))
+        store.sample(1001.001, self._state(1))
+        store.record_completion(Direction.NORTH, 1.0, 1000.999) # stamped before the sample above
+        store.sample(1001.5, self._state(1))
+        store.sample(1002.5, self._state(1))
+        store.flush()
+        store.sample(1002.7, self._state(1)) # after a flush, too
+        store.flush()
+
+        times = [t for t, _ in store.latest(Direction.NORTH, 'throughput', 10)]
+        self.assertEqual(times, sorted(set(times)))
+        self.assertEqual(times, [1000.0, 1001.0, 1002.0, 1003.0])
+        self.assertEqual(sum(v for _, v in store.query(Direction.NORTH, 'throughput', 1000.0, 1004.0)), 1.0)
+
+class TestProfiler(unittest.TestCase):
+    def test_phases_and_collapsed_output(self):
+        import pickle
+        import tempfile
+        profiler = Profiler("main", interval=0.001)
+        profiler.start()
+        with profiler.phase("tick"):
+            time.sleep(0.05)
+        profiler.stop()
+
+        # A lane process ships a pickled copy's snapshot back to the parent
+        lane = pickle.loads(pickle.dumps(Profiler("lane-North")))
+        lane.start()
+        with lane.phase("ipc"):
+            time.sleep(0.02)
+        lane.stop()
+        profiler.merge(lane.snapshot())
+
+        self.assertEqual(profiler.phase_calls[("main", "tick")], 1)
+        self.assertGreater(profiler.phase_samples[("main", "tick")], 0)
+        self.assertIn(("lane-North", "ipc"), profiler.phase_time)
+        self.assertIn("lane-North", profiler.summary())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.folded")
+            profiler.write_collapsed(path)
+            with open(path, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        self.assertTrue(any(line.startswith("main;MainThread;[tick];") for line in lines))
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            self.assertTrue(count.isdigit())
+
+class TestEngineEquivalence(unittest.TestCase):
+    def test_registered_engines_match_reference(self):
+        for seed in range(3):
+            script = arrival_script(seed, ticks=2400, rate=2.0, emergency_prob=0.1)
+            report = DifferentialHarness().run(script, ticks=2400)
+            self.assertTrue(report.equivalent, f"seed {seed}: {report.divergence}")
+            self.assertEqual(report.ticks, 2400)
+
+    def test_reports_first_divergent_tick(self):
+        @register_engine("fast-north")
+        class FastNorthEngine(ThreadEngine):
+            def __init__(self, tick_rate):
+                super().__init__(tick_rate)
+                self.lights[Direction.NORTH].speed += 1.0
+        self.addCleanup(ENGINES.pop, "fast-north")
+
+        script = arrival_script(0, ticks=400, rate=2.0)
+        first_north = min(a.tick for a in script if a.direction == Direction.NORTH)
+        report = DifferentialHarness(engines=["thread", "fast-north"]).run(script, ticks=400)
+        self.assertFalse(report.equivalent)
+        self.assertEqual(report.divergence.engine, "fast-north")
+        self.assertEqual(report.divergence.check, "positions")
+        self.assertEqual(report.divergence.tick, first_north)
+
+    def test_phase_timeline_uses_controller_cycle(self):
+        from src.equivalence import ProcessEngine
+        class ShortGreen(ProcessController):
+            green_duration = ProcessController.green_duration - 1
+
+        @register_engine("short-green")
+        class ShortGreenEngine(ProcessEngine):
+            controller = ShortGreen
+        self.addCleanup(ENGINES.pop, "short-green")
+
+        report = DifferentialHarness(engines=["thread", "short-green"]).run([], ticks=400)
+        self.assertEqual(report.divergence.check, "phases")
+        self.assertEqual(report.divergence.tick, int(ShortGreen.green_duration * 20))
+
 if __name__ == '__main__':
     unittest.main()